@@ -1,8 +1,11 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, Response, url_for
 import io
 import os
+import json
+import time
 import redis
 from rq import Queue
+from rq.job import Dependency
 from db import db_manager # Assuming db_manager is correctly implemented and handles data storage/retrieval
 from worker import (
     scrape_lyrics,
@@ -10,7 +13,15 @@ from worker import (
     scrape_freedium as worker_scrape_freedium,
     update_proxies as worker_update_proxies,
     search_simpmusic as worker_search_simpmusic,
+    scrape_lyrics_bulk_item,
 )
+import bulk
+from common import cache_totals
+from lyrics_scraper import simpmusic_miss_key
+from medium_scraper import is_current_article as is_current_medium_article
+from freedium_scraper import is_current_article as is_current_freedium_article
+from query_index import normalize_query
+from article_urls import article_key
 
 app = Flask(__name__)
 
@@ -18,6 +29,19 @@ redis_url = os.getenv('REDIS_URL')
 conn = redis.from_url(redis_url)
 q = Queue(connection=conn)
 
+# Bulk lookups: misses run as this many sequential job chains, so one setlist can't take every worker
+BULK_LANES = int(os.getenv('BULK_LANES', 3))
+BULK_MAX_QUERIES = int(os.getenv('BULK_MAX_QUERIES', 200))
+# Seconds one event-stream connection stays open; well below gunicorn's --timeout. Clients reconnect
+# with Last-Event-ID (EventSource does so by itself) and get only the items they haven't seen
+BULK_STREAM_TIMEOUT = int(os.getenv('BULK_STREAM_TIMEOUT', 55))
+
+def miss_response(miss, not_found, unavailable):
+    # Answered from the negative cache: same shape as a finished job, without queueing one.
+    # "not_found" misses are conclusive; anything else (blocked, timed out) is worth retrying later
+    message = not_found if miss.get('reason') == 'not_found' else unavailable
+    return jsonify({"status": "SUCCESS", "result": f'<div class="alert alert-warning">{message}</div>'})
+
 @app.route('/')
 def index():
     return render_template('index.html') # This now points to our new file
@@ -28,21 +52,16 @@ def search_lyrics():
     if not query:
         return jsonify({"error": "Search query is required."}), 400
 
-    # Add to search history (initial entry -- metadata/title may be added later once we have the scraped result)
-    db_manager.add_to_search_history('lyrics', query)
-
     # Try to get from DB first
     cached_result = db_manager.get_lyrics(query)
+
+    # One buffered history entry, with the cached title when there is one so the UI shows it immediately
+    title = cached_result.get('title') if isinstance(cached_result, dict) else None
+    db_manager.add_to_search_history('lyrics', query, metadata={'title': title} if title else None)
+
     if cached_result:
         cached_result.pop('_id', None) # Remove MongoDB's internal _id field if present
 
-        # If we have a cached title, add another history entry with metadata so UI shows the title immediately
-        if isinstance(cached_result, dict) and cached_result.get('title'):
-            try:
-                db_manager.add_to_search_history('lyrics', query, metadata={'title': cached_result.get('title')})
-            except Exception:
-                pass
-
         # Defensive check: Ensure expected fields are strings before rendering
         if isinstance(cached_result, dict):
             for key in ['title', 'lyrics', 'artist', 'source']:
@@ -55,6 +74,11 @@ def search_lyrics():
         cached_result['is_favorite'] = db_manager.is_favorite(query)
         return jsonify({"status": "SUCCESS", "result": render_template('lyrics_result.html', result=cached_result)})
 
+    miss = db_manager.get_miss('lyrics', normalize_query(query) or query)
+    if miss:
+        return miss_response(miss, "No lyrics were found for this song.",
+                             "Lyrics sources are temporarily unavailable. Please try again later.")
+
     # If not in DB, start a background job
     # Enqueue the actual worker function, not the Flask route handler
     job = q.enqueue(scrape_lyrics, query, job_timeout=3600, meta={'template_name': 'lyrics_result.html'})
@@ -64,35 +88,132 @@ def search_lyrics():
 def search_simpmusic():
     query = request.form.get('query')
     search_type = request.form.get('type', 'song')
+    # Picks another of the matches listed in a previous result; answered from the cached API response
+    index = request.form.get('index', type=int)
     if not query:
         return jsonify({"error": "Search query is required."}), 400
 
-    job = q.enqueue(worker_search_simpmusic, query, search_type, job_timeout=3600, meta={'template_name': 'lyrics_result.html'})
+    miss = db_manager.get_miss('simpmusic', simpmusic_miss_key(query, search_type))
+    if miss:
+        return miss_response(miss, "No lyrics found via SimpMusic API.",
+                             "SimpMusic API is temporarily unavailable. Please try again later.")
+
+    job = q.enqueue(worker_search_simpmusic, query, search_type, index, job_timeout=3600, meta={'template_name': 'lyrics_result.html'})
     return jsonify({"status": "PENDING", "task_id": job.get_id()})
 
+@app.route('/bulk_lyrics', methods=['POST'])
+def bulk_lyrics():
+    # JSON {"queries": [...]} or a form field with one query per line
+    payload = request.get_json(silent=True) or {}
+    queries = payload.get('queries') or request.form.get('queries', '').splitlines()
+    queries = [str(query).strip().lower() for query in queries if str(query).strip()]
+    if not queries:
+        return jsonify({"error": "At least one query is required."}), 400
+    if len(queries) > BULK_MAX_QUERIES:
+        return jsonify({"error": f"At most {BULK_MAX_QUERIES} queries per request."}), 400
+
+    batch_id = bulk.create_batch(conn, queries)
+    lanes = [None] * BULK_LANES
+    queued = 0
+    for index, query in enumerate(queries):
+        # Cache hits and recent misses are answered now; only the rest becomes jobs
+        cached_result = db_manager.get_lyrics(query, fields=("title", "artist", "lyrics", "source"))
+        if cached_result:
+            bulk.record_item(conn, batch_id, index, query, "found", cached_result)
+            continue
+        miss = db_manager.get_miss('lyrics', normalize_query(query) or query)
+        if miss:
+            if miss.get('reason') == 'not_found':
+                bulk.record_item(conn, batch_id, index, query, "not_found")
+            else:
+                bulk.record_item(conn, batch_id, index, query, "error", error="Lyrics sources are temporarily unavailable")
+            continue
+
+        lane = queued % BULK_LANES
+        depends_on = Dependency(jobs=[lanes[lane]], allow_failure=True) if lanes[lane] else None
+        lanes[lane] = q.enqueue(scrape_lyrics_bulk_item, batch_id, index, query, depends_on=depends_on, job_timeout=3600)
+        queued += 1
+
+    return jsonify({
+        "batch_id": batch_id,
+        "total": len(queries),
+        "queued": queued,
+        "status_url": url_for('bulk_lyrics_status', batch_id=batch_id),
+        "stream_url": url_for('bulk_lyrics_stream', batch_id=batch_id),
+    })
+
+@app.route('/bulk_lyrics/<batch_id>')
+def bulk_lyrics_status(batch_id):
+    batch = bulk.get_batch(conn, batch_id)
+    if batch is None:
+        return jsonify({"error": "Bulk lookup not found."}), 404
+    batch['items'] = [batch['items'][index] for index in sorted(batch['items'])]
+    return jsonify(batch)
+
+@app.route('/bulk_lyrics/<batch_id>/stream')
+def bulk_lyrics_stream(batch_id):
+    """
+    Server-sent events: one "item" event per finished query (cache hits first), then "done".
+    Each connection closes after BULK_STREAM_TIMEOUT seconds; every item's id is a hex bitmap of the
+    indexes sent so far, so a reconnect with Last-Event-ID resumes without repeating items.
+    """
+    try:
+        sent_bits = int(request.headers.get('Last-Event-ID') or '0', 16)
+    except ValueError:
+        sent_bits = 0
+
+    def events():
+        nonlocal sent_bits
+        sent = {index for index in range(sent_bits.bit_length()) if sent_bits >> index & 1}
+        give_up_at = time.monotonic() + BULK_STREAM_TIMEOUT
+        yield "retry: 1000\n\n"
+        while True:
+            batch = bulk.get_batch(conn, batch_id)
+            if batch is None:
+                yield f"event: error\ndata: {json.dumps({'error': 'Bulk lookup not found.'})}\n\n"
+                return
+            for index in sorted(set(batch['items']) - sent):
+                sent.add(index)
+                sent_bits |= 1 << index
+                item = {**batch['items'][index], "done": len(sent), "total": batch['total']}
+                yield f"id: {sent_bits:x}\nevent: item\ndata: {json.dumps(item)}\n\n"
+            if len(sent) >= batch['total']:
+                yield f"event: done\ndata: {json.dumps({'done': len(sent), 'total': batch['total']})}\n\n"
+                return
+            if time.monotonic() > give_up_at:
+                # Frees the worker thread; the client reconnects after the retry delay
+                return
+            yield ": waiting\n\n"  # Keeps proxies from closing an idle stream
+            time.sleep(1)
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/scrape_medium', methods=['POST'])
 def scrape_medium():
     url = request.form.get('url')
     if not url:
         return jsonify({"error": "Medium URL is required."}), 400
 
-    # Add to search history (initial entry)
-    db_manager.add_to_search_history('medium', url)
-
     # Try to get from DB first
     cached_result = db_manager.get_article(url)
-    if cached_result:
+
+    # One buffered history entry, with the article title when it's cached so the history shows it immediately
+    title = cached_result.get('title') if cached_result else None
+    db_manager.add_to_search_history('medium', url, metadata={'title': title} if title else None)
+
+    # Parsed by an older extractor: the job re-derives it from the cached page
+    if cached_result and is_current_medium_article(cached_result):
         cached_result.pop('_id', None)
-        # Add a follow-up history entry with explicit title metadata so the history shows the article title immediately
-        if cached_result.get('title'):
-            try:
-                db_manager.add_to_search_history('medium', url, metadata={'title': cached_result.get('title')})
-            except Exception:
-                pass
         cached_result['is_favorite'] = db_manager.is_favorite(url)
         return jsonify({"status": "SUCCESS", "result": render_template('medium_result.html', article=cached_result)})
 
-    # If not in DB, start a background job
+    miss = None if cached_result else db_manager.get_miss('article', article_key(url))
+    if miss:
+        return miss_response(miss, "This article could not be found.",
+                             "This article is temporarily unavailable. Please try again later.")
+
+    # Not in DB (or stale), start a background job
     job = q.enqueue(worker_scrape_medium, url, job_timeout=3600, meta={'template_name': 'medium_result.html'})
     return jsonify({"status": "PENDING", "task_id": job.get_id()})
 
@@ -103,23 +224,25 @@ def scrape_freedium():
     if not url:
         return jsonify({"error": "Freedium URL is required."}), 400
 
-    # Add to search history (initial entry)
-    db_manager.add_to_search_history('freedium', url)
-
     # Try to get from DB first
     cached_result = db_manager.get_article(url)
-    if cached_result:
+
+    # One buffered history entry, with the article title when it's cached so the history shows it immediately
+    title = cached_result.get('title') if cached_result else None
+    db_manager.add_to_search_history('freedium', url, metadata={'title': title} if title else None)
+
+    # Parsed by an older extractor: the job re-derives it from the cached page
+    if cached_result and is_current_freedium_article(cached_result):
         cached_result.pop('_id', None)
-        # Add a follow-up history entry with explicit title metadata so the history shows the article title immediately
-        if cached_result.get('title'):
-            try:
-                db_manager.add_to_search_history('freedium', url, metadata={'title': cached_result.get('title')})
-            except Exception:
-                pass
         cached_result['is_favorite'] = db_manager.is_favorite(url)
         return jsonify({"status": "SUCCESS", "result": render_template('freedium_result.html', article=cached_result)})
 
-    # If not in DB, start a background job
+    miss = None if cached_result else db_manager.get_miss('article', article_key(url))
+    if miss:
+        return miss_response(miss, "This article could not be found.",
+                             "This article is temporarily unavailable. Please try again later.")
+
+    # Not in DB (or stale), start a background job
     job = q.enqueue(worker_scrape_freedium, url, job_timeout=3600, meta={'template_name': 'freedium_result.html'})
     return jsonify({"status": "PENDING", "task_id": job.get_id()})
 
@@ -164,6 +287,11 @@ def job_status(job_id):
     return jsonify(response)
 
 
+@app.route('/cache_stats')
+def cache_stats_route():
+    """Cache hit/miss totals per tier (memory, disk, parsed), as published by the worker jobs."""
+    return jsonify({"status": "SUCCESS", "cache": cache_totals()})
+
 @app.route('/download_lyrics', methods=['POST'])
 def download_lyrics():
     title = request.form.get('title', 'lyrics')
@@ -232,39 +360,35 @@ def get_search_history():
     search_type = request.args.get('type')  # Optional: filter by type (lyrics, medium, simpmusic)
     history = db_manager.get_search_history(search_type)
 
+    # Titles for rows without metadata.title, one batched lookup per collection instead of one per row
+    untitled = [item for item in history if not (item.get('metadata') or {}).get('title')]
+    article_titles, lyrics_titles = {}, {}
+    try:
+        article_titles = db_manager.get_article_titles(
+            [item.get('query') for item in untitled if item.get('type') in ('medium', 'freedium')])
+    except Exception:
+        pass
+    try:
+        lyrics_titles = db_manager.get_lyrics_titles(
+            [item.get('query') for item in untitled if item.get('type') == 'lyrics'])
+    except Exception:
+        pass
+
     # Clean up for JSON serialization and compute a friendly display title
     for item in history:
         item.pop('_id', None)
         item['timestamp'] = item['timestamp'].isoformat() if hasattr(item['timestamp'], 'isoformat') else str(item['timestamp'])
 
-        # Prefer an explicit metadata.title if present
+        # Prefer an explicit metadata.title, then the stored article or lyrics title,
+        # and fall back to the raw query (URL or search text)
         meta_title = (item.get('metadata') or {}).get('title')
-        if meta_title:
-            item['display'] = meta_title
-            continue
-
-        # For article URLs, look up stored article title
         if item.get('type') in ('medium', 'freedium'):
-            try:
-                article = db_manager.get_article(item.get('query'))
-                if article and 'title' in article:
-                    item['display'] = article.get('title')
-                    continue
-            except Exception:
-                pass
-
-        # For lyrics searches, look up stored lyrics title
-        if item.get('type') == 'lyrics':
-            try:
-                lyrics = db_manager.get_lyrics(item.get('query'))
-                if lyrics and 'title' in lyrics:
-                    item['display'] = lyrics.get('title')
-                    continue
-            except Exception:
-                pass
-
-        # Fallback to showing the raw query (URL or search text)
-        item['display'] = item.get('query')
+            stored_title = article_titles.get(item.get('query'))
+        elif item.get('type') == 'lyrics':
+            stored_title = lyrics_titles.get(item.get('query'))
+        else:
+            stored_title = None
+        item['display'] = meta_title or stored_title or item.get('query')
 
     return jsonify({"status": "SUCCESS", "history": history})
 
@@ -0,0 +1,89 @@
+import re
+from urllib.parse import parse_qsl, unquote, urlencode, urlsplit, urlunsplit
+
+# Medium post ids are the hex suffix of the slug ("my-story-1a2b3c4d5e6f") or the /p/<id> short link
+_MEDIUM_ID = re.compile(r"(?:^|-)([0-9a-f]{10,12})$")
+_MEDIUM_HOST = re.compile(r"(^|\.)medium\.com$")
+_FREEDIUM_HOST = re.compile(r"(^|\.)freedium(-mirror)?\.cfd$")
+
+# Publications on their own domains that Medium serves; their subdomains count too
+MEDIUM_PUBLICATION_HOSTS = {"towardsdatascience.com", "betterprogramming.pub", "levelup.gitconnected.com",
+                            "plainenglish.io", "uxdesign.cc", "uxplanet.org", "blog.devgenius.io", "itnext.io",
+                            "proandroiddev.com", "infosecwriteups.com", "blog.stackademic.com", "towardsai.net",
+                            "bettermarketing.pub", "entrepreneurshandbook.co", "hackernoon.com"}
+
+# Query parameters that only say where a click came from
+TRACKING_PARAMS = {"source", "sk", "gi", "ref", "referrer", "fbclid", "gclid", "mc_cid", "mc_eid", "_branch_match_id",
+                   "_branch_referrer", "postpublishedtype", "responsesopen", "isframed"}
+
+
+def _is_tracking(param: str) -> bool:
+    param = param.lower()
+    return param in TRACKING_PARAMS or param.startswith("utm_")
+
+
+def _host(parts) -> str:
+    host = (parts.hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def _unwrap_freedium(url: str) -> str:
+    """The Medium URL a Freedium mirror link wraps (freedium.cfd/https://medium.com/...), else url itself."""
+    parts = urlsplit(url.strip())
+    if not _FREEDIUM_HOST.search(_host(parts)):
+        return url.strip()
+    inner = unquote(parts.path.lstrip("/"))
+    if parts.query:
+        inner += "?" + parts.query
+    if re.match(r"https?:/", inner):
+        # Some proxies collapse the double slash in the embedded scheme
+        return re.sub(r"^(https?):/+", r"\1://", inner)
+    if _MEDIUM_ID.search(inner.rstrip("/")):
+        return f"https://medium.com/p/{inner.rstrip('/').rsplit('-', 1)[-1]}"
+    return url.strip()
+
+
+def _is_medium_host(host: str) -> bool:
+    """True for medium.com, its subdomains and the publication domains in MEDIUM_PUBLICATION_HOSTS."""
+    return bool(_MEDIUM_HOST.search(host)) or any(host == h or host.endswith("." + h) for h in MEDIUM_PUBLICATION_HOSTS)
+
+
+def medium_post_id(url: str):
+    """The Medium post id in url (also inside a Freedium link), or None; other sites' slugs can end in hex too."""
+    parts = urlsplit(_unwrap_freedium(url))
+    if not _is_medium_host(_host(parts)):
+        return None
+    segments = [s for s in parts.path.split("/") if s]
+    if not segments:
+        return None
+    if len(segments) >= 2 and segments[-2] == "p" and re.fullmatch(r"[0-9a-f]{10,12}", segments[-1]):
+        return segments[-1]
+    match = _MEDIUM_ID.search(segments[-1])
+    if match and (_MEDIUM_HOST.search(_host(parts)) or len(segments[-1]) > len(match.group(1))):
+        return match.group(1)
+    return None
+
+
+def clean_article_url(url: str) -> str:
+    """url without tracking parameters, fragment, "www." or a trailing slash; the URL scrapers fetch."""
+    parts = urlsplit(url.strip())
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not _is_tracking(k)]
+    netloc = parts.netloc.lower()
+    if netloc.startswith("www."):
+        netloc = netloc[4:]
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit(((parts.scheme or "https").lower(), netloc, path, urlencode(query), ""))
+
+
+def article_key(url: str) -> str:
+    """
+    Stable key for the article url points to: "medium:<post id>" for Medium posts, reached directly,
+    through a known publication domain or through a Freedium mirror; otherwise the cleaned URL
+    without its scheme. Equivalent links share one stored document and one negative-cache entry.
+    """
+    if not url:
+        return url
+    post_id = medium_post_id(url)
+    if post_id:
+        return f"medium:{post_id}"
+    return clean_article_url(_unwrap_freedium(url)).split("://", 1)[-1]
@@ -0,0 +1,63 @@
+import json
+import time
+import uuid
+from typing import Dict, List, Optional
+
+# A bulk lookup lives in Redis as a manifest hash (queries, total, created_at) and an items hash
+# (index -> JSON result) that jobs fill in as they finish; both expire after BULK_TTL.
+KEY_PREFIX = "bulk:"
+BULK_TTL = 24 * 3600
+
+
+def _manifest_key(batch_id: str) -> str:
+    return f"{KEY_PREFIX}{batch_id}"
+
+
+def _items_key(batch_id: str) -> str:
+    return f"{KEY_PREFIX}{batch_id}:items"
+
+
+def create_batch(conn, queries: List[str]) -> str:
+    batch_id = uuid.uuid4().hex
+    pipe = conn.pipeline()
+    pipe.hset(_manifest_key(batch_id), mapping={
+        "queries": json.dumps(queries),
+        "total": len(queries),
+        "created_at": f"{time.time():.3f}",
+    })
+    pipe.expire(_manifest_key(batch_id), BULK_TTL)
+    pipe.execute()
+    return batch_id
+
+
+def record_item(conn, batch_id: str, index: int, query: str, status: str, result: Optional[Dict] = None,
+                error: Optional[str] = None) -> None:
+    """Stores one finished item; status is "found", "not_found" or "error"."""
+    item = {"index": index, "query": query, "status": status, "finished_at": time.time()}
+    if result is not None:
+        item["result"] = {k: result.get(k) for k in ("title", "artist", "lyrics", "source")}
+    if error:
+        item["error"] = error
+    pipe = conn.pipeline()
+    pipe.hset(_items_key(batch_id), index, json.dumps(item))
+    pipe.expire(_items_key(batch_id), BULK_TTL)
+    pipe.execute()
+
+
+def get_batch(conn, batch_id: str) -> Optional[Dict]:
+    """{"id", "queries", "total", "done", "items": {index: item}} or None if unknown or expired."""
+    pipe = conn.pipeline()
+    pipe.hgetall(_manifest_key(batch_id))
+    pipe.hgetall(_items_key(batch_id))
+    manifest, items = pipe.execute()
+    if not manifest:
+        return None
+    manifest = {k.decode() if isinstance(k, bytes) else k: v for k, v in manifest.items()}
+    items = {int(k): json.loads(v) for k, v in items.items()}
+    return {
+        "id": batch_id,
+        "queries": json.loads(manifest["queries"]),
+        "total": int(manifest["total"]),
+        "done": len(items),
+        "items": items,
+    }
@@ -0,0 +1,368 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# Shard directories are the first two bytes of the sha256 key, e.g. cache/ab/cd/<hash>.json.gz
+SHARD_DEPTH = 2
+ENTRY_SUFFIX = ".json.gz"
+LEGACY_SUFFIX = ".json"  # Flat, uncompressed files written by older versions
+# Eviction stops once usage is back under this fraction of the budget, so a full cache
+# doesn't rescan the tree on every subsequent write
+LOW_WATER_MARK = 0.9
+
+
+def _hash_key(key: str) -> str:
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _approx_size(value: Any) -> int:
+    """Cheap estimate of the memory held by a JSON-like value (strings dominate for cached pages)."""
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_approx_size(k) + _approx_size(v) for k, v in value.items()) + 64
+    if isinstance(value, (list, tuple)):
+        return sum(_approx_size(v) for v in value) + 56
+    return 16
+
+
+class MemoryCache:
+    """
+    Thread-safe, byte-bounded LRU cache held in process memory.
+
+    Each item keeps the timestamp it was written with, so an entry promoted
+    from the disk tier expires at the same moment it would on disk.
+    """
+
+    def __init__(self, max_bytes: int, ttl: int, max_item_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # Items larger than this are never held in memory (0 means max_bytes // 4)
+        self.max_item_bytes = max_item_bytes or max_bytes // 4
+
+        self._items: "OrderedDict[str, Tuple[Any, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str, max_age: Optional[float] = None) -> Any:
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, timestamp, size = item
+            if time.time() - timestamp > max_age:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, timestamp: Optional[float] = None, size: Optional[int] = None) -> None:
+        size = _approx_size(value) if size is None else size
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            self._pop(key)
+            if self.max_bytes <= 0 or size > self.max_item_bytes:
+                return
+            self._items[key] = (value, timestamp, size)
+            self._bytes += size
+            now = time.time()
+            # Drop expired items first, then the least recently used ones
+            if self._bytes > self.max_bytes:
+                for k in [k for k, (_, ts, _) in self._items.items() if now - ts > self.ttl]:
+                    self._pop(k)
+                    self.evictions += 1
+            while self._bytes > self.max_bytes and self._items:
+                self._pop(next(iter(self._items)))
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._pop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+    def _pop(self, key: str) -> None:
+        item = self._items.pop(key, None)
+        if item is not None:
+            self._bytes -= item[2]
+
+
+class DiskCache:
+    """
+    Sharded, gzip-compressed key/value cache on the local filesystem.
+
+    Entries are JSON dicts stored one per file. The file's mtime is the write
+    time (used for TTL) and its atime is bumped explicitly on every read so that
+    LRU eviction still works on noatime/relatime mounts. Several processes can
+    share one directory; all bookkeeping is derived from the files themselves.
+
+    The periodic sweeper is not started automatically: call start_sweeper()
+    once in a long-lived process (the RQ worker parent). The byte/entry budget
+    is enforced on write regardless, from usage counters seeded by one scan.
+    """
+
+    def __init__(self, directory: str, ttl: int, max_bytes: int = 0, max_entries: int = 0,
+                 eviction: str = "lru", sweep_interval: int = 300, compress_level: int = 6):
+        if eviction not in ("lru", "ttl"):
+            raise ValueError(f"Unknown eviction policy: {eviction}")
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes  # 0 disables the byte budget
+        self.max_entries = max_entries  # 0 disables the entry budget
+        self.eviction = eviction
+        self.sweep_interval = sweep_interval
+        self.compress_level = compress_level
+
+        self._lock = threading.Lock()
+        self._sweeper = None
+        # Approximate usage since the last sweep, so writes don't have to rescan the tree
+        self._approx_bytes = None
+        self._approx_entries = None
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    # -- paths ---------------------------------------------------------------
+
+    def _path(self, key: str) -> str:
+        h = _hash_key(key)
+        shards = [h[i * 2:i * 2 + 2] for i in range(SHARD_DEPTH)]
+        return os.path.join(self.directory, *shards, h + ENTRY_SUFFIX)
+
+    def _legacy_path(self, key: str) -> str:
+        return os.path.join(self.directory, _hash_key(key) + LEGACY_SUFFIX)
+
+    # -- public API ----------------------------------------------------------
+
+    def get(self, key: str, max_age: Optional[float] = None) -> Optional[Dict]:
+        """Returns the stored dict for key, or None if missing, corrupt or older than max_age (default: ttl)."""
+        max_age = self.ttl if max_age is None else max_age
+
+        path = self._path(key)
+        entry = self._read(path)
+        if entry is None:
+            entry = self._migrate_legacy(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+        if time.time() - entry.get("timestamp", 0) > max_age:
+            self.misses += 1
+            return None
+        self.hits += 1
+
+        try:
+            # Record the access for LRU without touching the write time
+            os.utime(path, (time.time(), os.stat(path).st_mtime))
+        except OSError:
+            pass
+        return entry
+
+    def set(self, key: str, entry: Dict) -> None:
+        if self._approx_bytes is None:
+            # First write in this process without a prior sweep: seed the usage counters
+            self.sweep()
+        entry = {**entry, "timestamp": entry.get("timestamp", time.time())}
+        path = self._path(key)
+        data = gzip.compress(json.dumps(entry).encode("utf-8"), compresslevel=self.compress_level)
+        try:
+            previous_size = os.stat(path).st_size
+        except OSError:
+            previous_size = None
+        self._atomic_write(path, data)
+        try:
+            # Keep mtime equal to the logical write time so the sweeper's TTL check matches get()
+            os.utime(path, (time.time(), entry["timestamp"]))
+        except OSError:
+            pass
+
+        with self._lock:
+            if self._approx_bytes is not None:
+                if previous_size is None:
+                    self._approx_bytes += len(data)
+                    self._approx_entries += 1
+                else:
+                    # Overwrite of an existing entry: only the size delta counts
+                    self._approx_bytes += len(data) - previous_size
+            over_budget = self._over_budget(self._approx_bytes, self._approx_entries)
+        if over_budget:
+            self.sweep()
+
+    def delete(self, key: str) -> None:
+        for path in (self._path(key), self._legacy_path(key)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def sweep(self) -> Dict:
+        """Removes expired and unreadable entries; if over budget, evicts down to the low-water mark."""
+        now = time.time()
+        removed = 0
+        live: List[Tuple[str, int, float, float]] = []
+
+        for path, st in self._scan():
+            # Zero-byte files are left behind by crashed non-atomic writes of older versions
+            if st.st_size == 0 or now - st.st_mtime > self.ttl:
+                removed += self._remove(path)
+                continue
+            live.append((path, st.st_size, st.st_atime, st.st_mtime))
+
+        total_bytes = sum(size for _, size, _, _ in live)
+        if self._over_budget(total_bytes, len(live)):
+            if self.eviction == "lru":
+                live.sort(key=lambda item: item[2])  # least recently read first
+            else:
+                live.sort(key=lambda item: item[3])  # closest to expiry first
+            while live and self._over_budget(total_bytes, len(live), LOW_WATER_MARK):
+                path, size, _, _ = live.pop(0)
+                removed += self._remove(path)
+                total_bytes -= size
+
+        with self._lock:
+            self._approx_bytes = total_bytes
+            self._approx_entries = len(live)
+        return {"entries": len(live), "bytes": total_bytes, "removed": removed}
+
+    def stats(self) -> Dict:
+        return {"hits": self.hits, "misses": self.misses,
+                "approx_entries": self._approx_entries, "approx_bytes": self._approx_bytes}
+
+    # -- internals -----------------------------------------------------------
+
+    def _over_budget(self, total_bytes, entries, fraction: float = 1.0) -> bool:
+        if total_bytes is None:
+            return False
+        if self.max_bytes and total_bytes > self.max_bytes * fraction:
+            return True
+        if self.max_entries and entries > int(self.max_entries * fraction):
+            return True
+        return False
+
+    def _read(self, path: str) -> Optional[Dict]:
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError):
+            # Truncated or corrupt entry; drop it so the next fetch rewrites it
+            self._remove(path)
+            return None
+
+    def _migrate_legacy(self, key: str) -> Optional[Dict]:
+        """Reads a flat uncompressed entry from an older version and rewrites it in the current format."""
+        legacy = self._legacy_path(key)
+        if not os.path.exists(legacy):
+            return None
+        try:
+            with open(legacy, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self._remove(legacy)
+            return None
+        self._remove(legacy)
+        if not isinstance(entry, dict) or time.time() - entry.get("timestamp", 0) > self.ttl:
+            return None
+        self.set(key, entry)
+        return entry
+
+    def _atomic_write(self, path: str, data: bytes) -> None:
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            self._remove(tmp_path)
+            raise
+
+    def _remove(self, path: str) -> int:
+        try:
+            os.remove(path)
+            return 1
+        except OSError:
+            return 0
+
+    def _scan(self):
+        """Yields (path, stat) for every entry, including legacy flat files and stale temp files."""
+        now = time.time()
+        stack = [(self.directory, 0)]
+        while stack:
+            directory, depth = stack.pop()
+            try:
+                it = os.scandir(directory)
+            except OSError:
+                continue
+            with it:
+                for item in it:
+                    try:
+                        if item.is_dir(follow_symlinks=False):
+                            # Only descend into shard directories so other data under the cache root is left alone
+                            if depth < SHARD_DEPTH and len(item.name) == 2:
+                                stack.append((item.path, depth + 1))
+                            continue
+                        st = item.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if item.name.startswith(".tmp-"):
+                        # Leftover from a writer that died mid-write
+                        if now - st.st_mtime > 3600:
+                            self._remove(item.path)
+                        continue
+                    if depth == SHARD_DEPTH and item.name.endswith(ENTRY_SUFFIX):
+                        yield item.path, st
+                    elif depth == 0 and item.name.endswith(LEGACY_SUFFIX):
+                        yield item.path, st
+
+    def start_sweeper(self) -> None:
+        """
+        Sweeps once now (seeding the usage counters that forked children inherit) and then
+        every sweep_interval seconds in a daemon thread. Call it from one long-lived process only.
+        """
+        self.sweep()
+        if self._sweeper is not None or self.sweep_interval <= 0:
+            return
+        self._sweeper = threading.Thread(target=self._sweep_loop, name="cache-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def _sweep_loop(self) -> None:
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Cache sweep failed: {e}")
@@ -1,97 +1,575 @@
 import os
-import random
-import requests
-import hashlib
+import copy
+import codecs
 import json
-import time  # Keep time for file cache
+import hashlib
+import time
+import threading
+import statistics
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from requests.adapters import HTTPAdapter
 try:
     from dotenv import load_dotenv
     load_dotenv()
 except Exception:
     # python-dotenv is optional; if not installed, rely on environment variables
     pass
+try:
+    import redis
+except Exception:
+    redis = None
+from cache_engine import DiskCache, MemoryCache
+from proxy_pool import ProxyPool, is_proxy_error
+from flaresolverr import FlareSolverrClient, host_of, looks_like_challenge
+from singleflight import SingleFlight
+from html_parsing import TargetWatcher
+from parse_cache import ParseCache
+from rate_limiter import HostRateLimiter, RateLimitTimeout
+try:
+    from rq import Queue
+except Exception:
+    Queue = None
 
 
 FLARE = os.environ.get("FLARE_URL") # FlareSolverr URL
-CACHE_DIR = "cache"
-TTL = 3600  # 1 hour
+REDIS_URL = os.environ.get("REDIS_URL")
+
+# Shared HTTP transport: number of per-host pools kept, and connections kept alive per host
+HTTP_POOL_CONNECTIONS = int(os.environ.get("HTTP_POOL_CONNECTIONS", 32))
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", 10))
+# Hard cap on concurrent requests to FlareSolverr from one process; extra callers wait for a slot, up to their own timeout
+FLARE_POOL_MAXSIZE = int(os.environ.get("FLARE_POOL_MAXSIZE", 4))
+
+# FlareSolverr browser sessions (one per host and proxy) and how long solved cookies are replayed
+FLARE_MAX_SESSIONS = int(os.environ.get("FLARE_MAX_SESSIONS", 8))
+FLARE_SESSION_IDLE_TTL = int(os.environ.get("FLARE_SESSION_IDLE_TTL", 600))  # seconds
+FLARE_CLEARANCE_TTL = int(os.environ.get("FLARE_CLEARANCE_TTL", 1200))  # seconds, capped by cf_clearance expiry
+
+# "hedged" races a direct request against FlareSolverr; "sequential" tries FlareSolverr, then direct
+FETCH_MODE = os.environ.get("FETCH_MODE", "hedged")
+FETCH_DEADLINE = float(os.environ.get("FETCH_DEADLINE", 90))  # overall budget per fetch, seconds
+# FlareSolverr is launched once the direct request has run this long without an answer. Until enough
+# direct latencies have been observed this default is used; afterwards the observed p50.
+HEDGE_DELAY = float(os.environ.get("HEDGE_DELAY", 3))
+DIRECT_TIMEOUT = 30
+FLARE_TIMEOUT = 60  # HTTP timeout; FlareSolverr's own maxTimeout is kept 30s below it
+# Per-host throttle shared by all workers: token bucket (requests/s, burst) plus an adaptive
+# concurrency limit between MIN and MAX that halves on 429/503. RATE_LIMIT_OVERRIDES is JSON,
+# e.g. {"api-lyrics.simpmusic.org": {"rate": 0.5, "burst": 2}}
+RATE_LIMIT_RPS = float(os.environ.get("RATE_LIMIT_RPS", 1.0))
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", 5))
+RATE_LIMIT_CONCURRENCY = int(os.environ.get("RATE_LIMIT_CONCURRENCY", 4))
+RATE_LIMIT_MIN_CONCURRENCY = int(os.environ.get("RATE_LIMIT_MIN_CONCURRENCY", 1))
+RATE_LIMIT_MAX_CONCURRENCY = int(os.environ.get("RATE_LIMIT_MAX_CONCURRENCY", 8))
+RATE_LIMIT_OVERRIDES = json.loads(os.environ.get("RATE_LIMIT_OVERRIDES") or "{}")
+# Direct responses are read as a stream: never more than FETCH_MAX_BYTES, and, when the caller
+# names the elements it needs (fetch_with_flaresolverr's until=), only until those have been seen
+STREAM_FETCH = os.environ.get("STREAM_FETCH", "1").lower() not in ("0", "false", "no")
+FETCH_MAX_BYTES = int(os.environ.get("FETCH_MAX_BYTES", 8 * 1024 * 1024))
+STREAM_CHUNK_SIZE = 64 * 1024
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+CACHE_DIR = os.environ.get("CACHE_DIR", "cache")
+TTL = int(os.environ.get("CACHE_TTL", 3600))  # 1 hour, for pages fetched without a source
+
+# How long a page counts as fresh, per kind of page (seconds)
+CACHE_TTLS = {
+    "proxies": int(os.environ.get("CACHE_TTL_PROXIES", 600)),
+    "article": int(os.environ.get("CACHE_TTL_ARTICLE", 86400)),
+    "lyrics_search": int(os.environ.get("CACHE_TTL_LYRICS_SEARCH", 3600)),
+    "lyrics_page": int(os.environ.get("CACHE_TTL_LYRICS_PAGE", 7 * 86400)),
+}
+# Past its TTL a page is still served for this long while it is refreshed in the background
+CACHE_STALE_TTL = int(os.environ.get("CACHE_STALE_TTL", 86400))
+# Entries are kept this long so stale pages can be served and revalidated with conditional requests
+CACHE_RETENTION = max([TTL, *CACHE_TTLS.values()]) + CACHE_STALE_TTL
+
+# Raw HTML cache limits. 0 disables a limit; eviction is "lru" or "ttl" (soonest-to-expire first)
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", 512 * 1024 * 1024))
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 20000))
+CACHE_EVICTION = os.environ.get("CACHE_EVICTION", "lru")
+CACHE_SWEEP_INTERVAL = int(os.environ.get("CACHE_SWEEP_INTERVAL", 300))  # seconds
+
+html_cache = DiskCache(
+    CACHE_DIR,
+    ttl=CACHE_RETENTION,
+    max_bytes=CACHE_MAX_BYTES,
+    max_entries=CACHE_MAX_ENTRIES,
+    eviction=CACHE_EVICTION,
+    sweep_interval=CACHE_SWEEP_INTERVAL,
+)
+
+# Per-process tier in front of the disk cache; repeat fetches within a worker skip disk I/O and JSON decoding.
+# RQ forks a process per job, so in practice this lives for one job (e.g. the search and song
+# pages of a single lyrics lookup); it is not shared across jobs or workers.
+MEMORY_CACHE_MAX_BYTES = int(os.environ.get("MEMORY_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+memory_cache = MemoryCache(MEMORY_CACHE_MAX_BYTES, ttl=CACHE_RETENTION)
 
-if not os.path.exists(CACHE_DIR):
-    os.makedirs(CACHE_DIR)
+# Extractor outputs per (page content hash, extractor, version); see parse_cache.ParseCache
+PARSE_CACHE_TTL = int(os.environ.get("PARSE_CACHE_TTL", 7 * 86400))
+PARSE_CACHE_MEMORY_BYTES = int(os.environ.get("PARSE_CACHE_MEMORY_BYTES", 16 * 1024 * 1024))
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """
+    Process-wide requests.Session with pooled keep-alive connections, shared by the fetch layer,
+    the scrapers and the SimpMusic lookup. Rebuilt after a fork so processes never share sockets.
+    """
+    global _session, _session_pid
+    if _session is not None and _session_pid == os.getpid():
+        return _session
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            session = requests.Session()
+            session.mount("http://", HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE))
+            session.mount("https://", HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE))
+            if FLARE:
+                # Longest prefix wins, so FlareSolverr gets its own pool; concurrency is bounded by the
+                # client's slots (flare below), which, unlike pool_block, give up within the caller's timeout
+                session.mount(FLARE, HTTPAdapter(pool_connections=1, pool_maxsize=FLARE_POOL_MAXSIZE))
+            _session = session
+            _session_pid = os.getpid()
+    return _session
+
+_redis_client = None
+
+def get_redis():
+    """Shared Redis client for cross-worker state in the fetch layer, or None when Redis isn't configured."""
+    global _redis_client
+    if _redis_client is None and redis is not None and REDIS_URL:
+        # Connections are opened lazily and redis-py resets its pool after a fork
+        _redis_client = redis.from_url(REDIS_URL)
+    return _redis_client
+
+# Proxy health lives in Redis so it outlives RQ's per-job processes and is shared by all workers
+proxy_pool = ProxyPool("proxies.txt", redis_client=get_redis(), metadata_path="proxies.json")
+
+flare = FlareSolverrClient(
+    FLARE,
+    get_session,
+    redis_client=get_redis(),
+    max_sessions=FLARE_MAX_SESSIONS,
+    session_idle_ttl=FLARE_SESSION_IDLE_TTL,
+    clearance_ttl=FLARE_CLEARANCE_TTL,
+    max_concurrency=FLARE_POOL_MAXSIZE,
+)
+
+rate_limiter = HostRateLimiter(
+    get_redis(),
+    rate=RATE_LIMIT_RPS,
+    burst=RATE_LIMIT_BURST,
+    initial_concurrency=RATE_LIMIT_CONCURRENCY,
+    min_concurrency=RATE_LIMIT_MIN_CONCURRENCY,
+    max_concurrency=RATE_LIMIT_MAX_CONCURRENCY,
+    lease_seconds=FETCH_DEADLINE + 60,
+    overrides=RATE_LIMIT_OVERRIDES,
+)
+
+# Shared by every worker, so a page one job already parsed is never parsed again by another
+parse_cache = ParseCache(get_redis(), ttl=PARSE_CACHE_TTL, memory_bytes=PARSE_CACHE_MEMORY_BYTES)
+
+# Identical URLs requested by several jobs at once are fetched by one of them. The leader renews its
+# lease while it fetches; followers wait out the worst case of _fetch_remote: clearance replay
+# (up to 15s for a rate-limit slot plus a 15s request) before the FETCH_DEADLINE fetch, plus slack
+# for reading the body.
+SINGLE_FLIGHT_MAX_WAIT = 15 + 15 + FETCH_DEADLINE + 30
+single_flight = SingleFlight(get_redis(), lease_seconds=30, max_wait=SINGLE_FLIGHT_MAX_WAIT)
+
+def _flare_proxy_failure(data):
+    """True when a non-ok FlareSolverr solution blames the proxy rather than the target site."""
+    message = str(data.get("message", "")).lower()
+    return "proxy" in message or "err_tunnel" in message or "err_connection" in message
 
 def get_random_proxy():
-    """Reads proxies from proxies.txt and returns a random one."""
+    """Returns a proxy from the shared pool, preferring fast healthy ones. Kept for existing callers."""
+    return proxy_pool.acquire()
+
+def cache_ttl(source=None):
+    """Freshness TTL for a kind of page ("proxies", "article", "lyrics_search", "lyrics_page")."""
+    return CACHE_TTLS.get(source, TTL)
+
+def _validators(headers):
+    """ETag/Last-Modified from a response, for later conditional requests."""
+    headers = {k.lower(): v for k, v in (headers or {}).items()}
+    return {k: headers[h] for k, h in (("etag", "etag"), ("last_modified", "last-modified")) if headers.get(h)}
+
+def _load_entry(url):
+    """Newest cached entry for url (any age within retention): {"html", "cookies", "timestamp", "validators"}."""
+    entry = memory_cache.get(url)
+    if entry is None:
+        entry = html_cache.get(url)
+        if entry is None:
+            return None
+        memory_cache.set(url, {**entry, "cookies": copy.deepcopy(entry["cookies"])}, timestamp=entry["timestamp"])
+        return entry
+    # The memory tier hands out the same objects to every caller; copy the mutable cookie container
+    return {**entry, "cookies": copy.deepcopy(entry["cookies"])}
+
+def _usable(entry, until=None):
+    """
+    A page cut short once the elements one caller needed had arrived only serves callers asking for
+    the same elements; a page cut at FETCH_MAX_BYTES serves everyone, since a re-fetch would be cut too.
+    """
+    partial = entry.get("partial")
+    return not partial or partial == "size" or (until is not None and partial == list(until))
+
+def _load_cache(url, source=None, until=None):
+    entry = _load_entry(url)
+    if entry is None or not _usable(entry, until) or time.time() - entry["timestamp"] > cache_ttl(source):
+        return None
+    return entry["html"], entry["cookies"]
+
+def _save_cache(url, html, cookies, validators=None, partial=None):
+    entry = {"html": html, "cookies": cookies, "timestamp": time.time(), "validators": validators or {}}
+    if partial:
+        entry["partial"] = partial
+    memory_cache.set(url, {**entry, "cookies": copy.deepcopy(cookies)}, timestamp=entry["timestamp"])
     try:
-        with open("proxies.txt", "r") as f:
-            proxies = [line.strip() for line in f if line.strip()]
-        if proxies:
-            return random.choice(proxies)
-    except FileNotFoundError:
-        print("proxies.txt not found. Continuing without proxy.")
-    return None
+        html_cache.set(url, entry)
+    except OSError as e:
+        # A full or read-only disk shouldn't fail the scrape itself
+        print(f"Failed to write cache entry for {url}: {e}")
+
+def cached_page(url, until=None):
+    """The cached HTML for url whatever its age (None if there is none), for re-deriving results without a fetch."""
+    entry = _load_entry(url)
+    if entry is None or not _usable(entry, until):
+        return None
+    return entry["html"]
+
+def cache_stats():
+    """Hit/miss counters for the raw HTML and parse cache tiers of this process."""
+    return {"memory": memory_cache.stats(), "disk": html_cache.stats(), "parsed": parse_cache.stats()}
 
-def _key_to_file(url):
-    h = hashlib.sha256(url.encode()).hexdigest()
-    return os.path.join(CACHE_DIR, h + ".json")
+# Totals across all processes: RQ jobs run in short-lived forks, so each adds its counts here before exiting
+CACHE_STATS_KEY = "cache_stats:totals"
+_published_stats = {}
+
+def publish_cache_stats():
+    """Adds this process's cache hits/misses since the last call to the shared totals in Redis."""
+    conn = get_redis()
+    if conn is None:
+        return
+    current = {f"{tier}:{name}": stats[name] for tier, stats in cache_stats().items() for name in ("hits", "misses")}
+    deltas = {field: value - _published_stats.get(field, 0) for field, value in current.items()}
+    try:
+        pipe = conn.pipeline()
+        for field, delta in deltas.items():
+            if delta:
+                pipe.hincrby(CACHE_STATS_KEY, field, delta)
+        pipe.execute()
+        _published_stats.update(current)
+    except Exception as e:
+        print(f"Could not publish cache stats: {e}")
 
-def _load_cache(url):
-    path = _key_to_file(url)
-    if not os.path.exists(path):
+def cache_totals():
+    """{tier: {"hits", "misses", "hit_rate"}} summed over every process that published, or {} without Redis."""
+    conn = get_redis()
+    if conn is None:
+        return {}
+    totals = {}
+    for field, value in conn.hgetall(CACHE_STATS_KEY).items():
+        tier, name = (field.decode() if isinstance(field, bytes) else field).split(":", 1)
+        totals.setdefault(tier, {"hits": 0, "misses": 0})[name] = int(value)
+    for counts in totals.values():
+        lookups = counts["hits"] + counts["misses"]
+        counts["hit_rate"] = round(counts["hits"] / lookups, 3) if lookups else 0.0
+    return totals
+
+def _read_body(r, until=None):
+    """
+    Reads a stream=True response incrementally. Returns (text, partial): partial is list(until) if
+    reading stopped once every element in until had been closed, "size" if the body hit
+    FETCH_MAX_BYTES, None if it was read completely. The connection is closed on an early stop.
+    """
+    if not STREAM_FETCH:
+        return r.text, None
+    decoder = codecs.getincrementaldecoder(r.encoding or "utf-8")(errors="replace")
+    watcher = TargetWatcher(until) if until else None
+    chunks, size, partial = [], 0, None
+    try:
+        for raw in r.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+            size += len(raw)
+            if size > FETCH_MAX_BYTES:
+                raw = raw[:len(raw) - (size - FETCH_MAX_BYTES)]
+                partial = "size"
+            text = decoder.decode(raw)
+            chunks.append(text)
+            if partial:
+                print(f"Stopped reading {r.url} at FETCH_MAX_BYTES ({FETCH_MAX_BYTES} bytes)")
+                break
+            if watcher is not None:
+                watcher.feed(text)
+                if watcher.complete:
+                    partial = list(until)
+                    break
+        chunks.append(decoder.decode(b"", final=True))
+    finally:
+        r.close()
+    return "".join(chunks), partial
+
+def _fetch_with_clearance(url, until=None):
+    """
+    Replays a previously solved Cloudflare clearance (cookies + user agent, same proxy) on a
+    plain request. Returns (html, cookies, validators, partial), or None if there is no clearance or it stopped working.
+    """
+    host = host_of(url)
+    clearance = flare.clearance(host)
+    if clearance is None:
         return None
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    if time.time() - data["timestamp"] > TTL:
+    proxy = clearance.get("proxy")
+    proxies = {"http": f"http://{proxy}", "https": f"http://{proxy}"} if proxy else None
+    headers, cookies = flare.replay_headers(clearance)
+    try:
+        with rate_limiter.slot(host, timeout=15):
+            r = get_session().get(url, headers=headers, cookies=cookies, proxies=proxies, timeout=15, stream=STREAM_FETCH)
+            rate_limiter.record(host, r.status_code)
+            if looks_like_challenge(r):
+                # Clearance expired or was revoked; the next FlareSolverr solve stores a fresh one
+                flare.invalidate_clearance(host)
+                r.close()
+                return None
+            if r.status_code != 200:
+                r.close()
+                return None
+            html, partial = _read_body(r, until)
+    except (requests.exceptions.RequestException, RateLimitTimeout) as e:
+        print(f"Replaying clearance for {host} failed: {e}")
         return None
-    return data["html"], data["cookies"]
+    cookies.update(r.cookies.get_dict())
+    return html, cookies, _validators(r.headers), partial
+
+_direct_latencies = deque(maxlen=50)
+_hedge_executor = None
+_hedge_executor_pid = None
+
+def _hedge_pool():
+    global _hedge_executor, _hedge_executor_pid
+    with _session_lock:
+        if _hedge_executor is None or _hedge_executor_pid != os.getpid():
+            # Abandoned losers keep running until their own timeout, so leave headroom for them
+            _hedge_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="fetch-hedge")
+            _hedge_executor_pid = os.getpid()
+    return _hedge_executor
+
+def _hedge_delay():
+    if len(_direct_latencies) < 5:
+        return HEDGE_DELAY
+    return statistics.median(_direct_latencies)
 
-def _save_cache(url, html, cookies):
-    path = _key_to_file(url)
-    data = {"timestamp": time.time(), "html": html, "cookies": cookies}
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f)
+def _direct_leg(url, proxy, timeout, stale=None, until=None):
+    """
+    One direct GET. Returns (result, proxy_ok, latency) where result is (html, cookies, validators, partial)
+    or None and proxy_ok is True/False for an outcome the proxy is responsible for, None otherwise.
+    With a stale cache entry the request is conditional, and a 304 revalidates that entry.
+    The body is streamed and may stop early (see _read_body).
+    """
+    proxies = {"http": f"http://{proxy}", "https": f"http://{proxy}"} if proxy else None
+    headers = {"User-Agent": USER_AGENT}
+    validators = (stale or {}).get("validators") or {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    host = host_of(url)
+    waited_from = time.monotonic()
+    try:
+        with rate_limiter.slot(host, timeout=timeout):
+            started = time.monotonic()
+            r = get_session().get(url, headers=headers, proxies=proxies, timeout=max(1, timeout - (started - waited_from)),
+                                  stream=STREAM_FETCH)
+            rate_limiter.record(host, r.status_code)
+            # The proxy delivered a response, even if the target then rejects it (403, 404, ...)
+            latency = time.monotonic() - started
+            if r.status_code == 304 and validators:
+                # Unchanged since we cached it: no body was transferred
+                r.close()
+                _direct_latencies.append(latency)
+                return (stale["html"], stale["cookies"], validators, stale.get("partial")), True, latency
+            if not r.ok or looks_like_challenge(r):
+                r.close()
+                print(f"Direct request for {url} returned {r.status_code}")
+                return None, True, latency
+            html, partial = _read_body(r, until)
+    except RateLimitTimeout as e:
+        print(f"Direct request for {url} not sent: {e}")
+        return None, None, None
+    except requests.exceptions.RequestException as e:
+        print(f"Direct request failed for {url}: {e}")
+        return None, (False if is_proxy_error(e) else None), None
+    # Time to the response headers; body download time depends on page size, not the proxy
+    _direct_latencies.append(latency)
+    return (html, dict(r.cookies), _validators(r.headers), partial), True, latency
+
+def _flare_leg(url, proxy, timeout, stale=None, until=None):
+    """One FlareSolverr request.get, same return shape as _direct_leg (latency is never reported)."""
+    host = host_of(url)
+    waited_from = time.monotonic()
+    try:
+        # FlareSolverr still hits the target host, so it draws from the same per-host budget
+        with rate_limiter.slot(host, timeout=timeout):
+            timeout = max(5, timeout - (time.monotonic() - waited_from))
+            max_timeout = int(max(5, min(30, timeout - 30)) * 1000)
+            # Runs in the browser session kept for this host and proxy, so Cloudflare is solved once per session
+            data = flare.request_get(url, proxy, max_timeout=max_timeout, timeout=timeout)
+    except RateLimitTimeout as e:
+        print(f"FlareSolverr request for {url} not sent: {e}")
+        return None, None, None
+    except (requests.exceptions.RequestException, ValueError) as e:
+        # Errors talking to FlareSolverr itself are not the proxy's fault
+        print(f"Error communicating with FlareSolverr for {url}: {e}")
+        return None, None, None
+    rate_limiter.record(host, (data.get("solution") or {}).get("status"))
+    if data.get("status") == "ok":
+        # Solve time is dominated by the challenge, so it isn't recorded as proxy latency
+        solution = data["solution"]
+        return (solution["response"], solution["cookies"], _validators(solution.get("headers")), None), True, None
+    print(f"FlareSolverr returned non-ok status for {url}: {data.get('message')}")
+    return None, (False if _flare_proxy_failure(data) else None), None
+
+def _reported_leg(leg, url, proxy, timeout, stale=None, until=None):
+    result, proxy_ok, latency = leg(url, proxy, timeout, stale, until)
+    if proxy_ok is not None:
+        proxy_pool.report(proxy, proxy_ok, latency)
+    return result
 
-def fetch_with_flaresolverr(url):
-    cached_data = _load_cache(url) # This cache is for raw HTML, separate from DB
-    if cached_data:
-        return cached_data
+def _fetch_hedged(url, deadline, stale=None, until=None):
+    """
+    Starts a direct request and, if it hasn't produced a valid page within the hedge delay (or fails
+    sooner), FlareSolverr in parallel, each through its own proxy. The first valid page wins; the
+    loser is abandoned and its result discarded. Up to three rounds, all within the deadline.
+    """
+    executor = _hedge_pool()
+    max_rounds = 3
+    for _ in range(max_rounds):
+        remaining = deadline - time.monotonic()
+        if remaining <= 1:
+            break
+        pending = {executor.submit(_reported_leg, _direct_leg, url, proxy_pool.acquire(), min(DIRECT_TIMEOUT, remaining), stale, until)}
+        # Without FlareSolverr configured there is nothing to hedge with
+        flare_started = not FLARE
+        hedge_at = time.monotonic() + _hedge_delay()
 
-    # Retry mechanism to handle bad proxies and timeouts
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                return None
+            wait_for = deadline - now if flare_started else max(0, min(hedge_at, deadline) - now)
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if result:
+                    for loser in pending:
+                        loser.cancel()  # Only helps if it hasn't started; running requests are abandoned
+                    return result
+            if not flare_started and (not pending or time.monotonic() >= hedge_at):
+                remaining = deadline - time.monotonic()
+                pending.add(executor.submit(_reported_leg, _flare_leg, url, proxy_pool.acquire(), min(FLARE_TIMEOUT, remaining)))
+                flare_started = True
+    return None
+
+def _fetch_sequential(url, deadline, stale=None, until=None):
+    """The original strategy: FlareSolverr first, then a direct request, up to three times."""
     max_retries = 3
     for attempt in range(max_retries):
-        proxy = get_random_proxy()
-        payload = {"cmd": "request.get", "url": url, "maxTimeout": 30000}
-        if proxy:
-            payload["proxy"] = f"http://{proxy}"
+        remaining = deadline - time.monotonic()
+        if remaining <= 1:
+            break
+        proxy = proxy_pool.acquire()
+        result, flare_ok, _ = _flare_leg(url, proxy, min(FLARE_TIMEOUT, remaining))
+        if result:
+            proxy_pool.report(proxy, True)
+            return result
 
+        remaining = deadline - time.monotonic()
+        if remaining <= 1:
+            break
+        result, direct_ok, latency = _direct_leg(url, proxy, min(DIRECT_TIMEOUT, remaining), stale, until)
+        # The proxy is charged at most once per attempt, and never right after working
+        if direct_ok:
+            proxy_pool.report(proxy, True, latency)
+        elif flare_ok is False or direct_ok is False:
+            proxy_pool.report(proxy, False)
+        if result:
+            return result
+        print(f"Fetch attempt {attempt+1}/{max_retries} failed for {url}")
+    return None
+
+def _fetch_remote(url, stale=None, until=None):
+    """
+    Fetches url from the network and fills the cache. Returns (html, cookies) or None.
+    stale is the expired cache entry, if any, used to make direct requests conditional.
+    until lists the elements the caller needs; direct downloads stop once they've arrived.
+    """
+    # Cheap path: reuse cookies FlareSolverr already solved for this host
+    result = _fetch_with_clearance(url, until)
+    if not result:
+        # Every strategy shares one overall deadline, instead of up to 3 x (60s + 30s)
+        deadline = time.monotonic() + FETCH_DEADLINE
+        if FETCH_MODE == "sequential":
+            result = _fetch_sequential(url, deadline, stale, until)
+        else:
+            result = _fetch_hedged(url, deadline, stale, until)
+    if not result:
+        return None
+    html, cookies, validators, partial = result
+    _save_cache(url, html, cookies, validators, partial)
+    return html, cookies
+
+def _flight_key(url, until=None):
+    # Callers waiting on a page cut short for other elements can't use it, so they fly separately
+    return url if not until else f"{url}#until={','.join(until)}"
+
+def refresh_cached_page(url, source=None, until=None):
+    """Re-fetches a stale page in the background; a no-op if someone already refreshed it."""
+    if _load_cache(url, source, until):
+        return
+    stale = _load_entry(url)
+    if stale is not None and not _usable(stale, until):
+        stale = None
+    single_flight.do(_flight_key(url, until), lambda: _fetch_remote(url, stale, until),
+                     peek=lambda: _load_cache(url, source, until))
+
+def _schedule_refresh(url, source, until=None):
+    """Queues one background refresh per stale URL, on RQ when available, otherwise on a thread."""
+    conn = get_redis()
+    if conn is not None and Queue is not None:
         try:
-            # Increased timeout to 60s to exceed FlareSolverr's maxTimeout of 30s
-            r = requests.post(FLARE, json=payload, timeout=60)
-            r.raise_for_status()
-            data = r.json()
-            if data.get("status") == "ok":
-                html, cookies = data["solution"]["response"], data["solution"]["cookies"]
-                _save_cache(url, html, cookies)
-                return html, cookies
-            # If FlareSolverr returns not ok, fallback to direct request
-            print(f"FlareSolverr returned non-ok status (attempt {attempt+1}/{max_retries}), falling back to direct request")
-        except requests.exceptions.RequestException as e:
-            print(f"Error communicating with FlareSolverr (attempt {attempt+1}/{max_retries}): {e}, falling back to direct request")
-
-        # Fallback to direct request
-        try:
-            headers = {
-                "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-            }
-            proxies = None
-            if proxy:
-                proxies = {"http": f"http://{proxy}", "https": f"http://{proxy}"}
-            r = requests.get(url, headers=headers, proxies=proxies, timeout=30)
-            r.raise_for_status()
-            html = r.text
-            cookies = dict(r.cookies)
-            _save_cache(url, html, cookies)
-            return html, cookies
-        except requests.exceptions.RequestException as e:
-            print(f"Direct request also failed (attempt {attempt+1}/{max_retries}): {e}")
-            
+            guard = "swr:refresh:" + hashlib.sha256(url.encode()).hexdigest()
+            if conn.set(guard, 1, nx=True, ex=int(FETCH_DEADLINE) + 30):
+                Queue("low", connection=conn).enqueue(refresh_cached_page, url, source, until, job_timeout=int(FETCH_DEADLINE) + 60)
+            return
+        except Exception as e:
+            print(f"Could not queue background refresh of {url}: {e}")
+    threading.Thread(target=refresh_cached_page, args=(url, source, until), daemon=True).start()
+
+def fetch_with_flaresolverr(url, source=None, until=None):
+    """
+    Returns (html, cookies) for url, or (None, None). source selects the freshness TTL (see CACHE_TTLS).
+    A page past its TTL but within CACHE_STALE_TTL is returned immediately and refreshed in the background.
+    until (CSS selectors, see html_parsing) names the elements the caller reads: a direct download
+    stops once the first match of each has been closed, and the returned page may end there.
+    """
+    entry = _load_entry(url) # This cache is for raw HTML, separate from DB
+    if entry is not None and not _usable(entry, until):
+        entry = None
+    if entry:
+        age = time.time() - entry["timestamp"]
+        if age <= cache_ttl(source):
+            return entry["html"], entry["cookies"]
+        if age <= cache_ttl(source) + CACHE_STALE_TTL:
+            _schedule_refresh(url, source, until)
+            return entry["html"], entry["cookies"]
+
+    # Concurrent jobs asking for the same URL wait for one fetch instead of each running FlareSolverr
+    result = single_flight.do(_flight_key(url, until), lambda: _fetch_remote(url, entry, until),
+                              peek=lambda: _load_cache(url, source, until))
+    if result:
+        html, cookies = result
+        return html, cookies
     return None, None
@@ -1,24 +1,91 @@
 import os
+import zlib
+import atexit
 try:
     from pymongo import MongoClient
+    from pymongo.errors import DuplicateKeyError
 except Exception:
     MongoClient = None
+
+    class DuplicateKeyError(Exception):
+        pass
 try:
     from dotenv import load_dotenv
     load_dotenv()
 except Exception:
     # If python-dotenv isn't installed, rely on environment variables already set
     pass
+import time
+import threading
 from datetime import datetime, timedelta
+from query_index import QueryIndex, normalize_query
+from article_urls import article_key
+from sqlite_store import SQLiteStore
 
 # Environment variables for MongoDB connection
 MONGO_URL = os.environ.get("MONGO_URL")
 DB_NAME = os.environ.get("DB_NAME", "scrapper_db")
 
+# "mongo" uses MongoDB and falls back to SQLite when pymongo is missing or the server can't be
+# reached; "sqlite" skips MongoDB. The SQLite file is shared by every process on the box.
+DB_BACKEND = os.environ.get("DB_BACKEND", "mongo").lower()
+SQLITE_PATH = os.environ.get("SQLITE_PATH", f"{DB_NAME}.sqlite3")
+
 # TTL for database entries (e.g., 7 days)
 # Data older than this will be automatically removed by MongoDB's TTL index
 DB_TTL_DAYS = int(os.environ.get("DB_TTL_DAYS", 7))
 
+# Negative cache: how long a lookup that found nothing is answered from the misses collection.
+# "not_found" misses (every source answered, none had it) are kept longer than "unavailable"
+# ones (errors or timeouts), which may clear up on their own. Both are seconds.
+NEGATIVE_TTL = int(os.environ.get("NEGATIVE_TTL", 6 * 3600))
+NEGATIVE_ERROR_TTL = int(os.environ.get("NEGATIVE_ERROR_TTL", 600))
+
+# Similarity (0-1, trigram Dice) a stored query/title must reach to answer a lyrics lookup
+# Fuzzy hits are served as the answer, so candidates must also name the same words (query_index.tokens_agree)
+LYRICS_FUZZY_THRESHOLD = float(os.environ.get("LYRICS_FUZZY_THRESHOLD", 0.85))
+# How often the fuzzy index picks up lyrics saved by other processes, in seconds
+LYRICS_INDEX_REFRESH = int(os.environ.get("LYRICS_INDEX_REFRESH", 30))
+
+# Search history is written behind: entries are buffered per process and flushed with one
+# insert_many every HISTORY_FLUSH_INTERVAL seconds or once HISTORY_FLUSH_SIZE are waiting.
+# A repeat of the previous search bumps that row's count instead of adding a row, and only
+# the newest HISTORY_MAX_ROWS rows are kept.
+HISTORY_FLUSH_INTERVAL = float(os.environ.get("HISTORY_FLUSH_INTERVAL", 2))
+HISTORY_FLUSH_SIZE = int(os.environ.get("HISTORY_FLUSH_SIZE", 50))
+HISTORY_MAX_ROWS = int(os.environ.get("HISTORY_MAX_ROWS", 1000))
+
+# Large text fields are stored zlib-compressed and decompressed on read; documents written before
+# (plain strings) read back unchanged. 0 disables compression of new writes.
+COMPRESSED_FIELDS = ("content", "lyrics")
+DB_COMPRESS_MIN_BYTES = int(os.environ.get("DB_COMPRESS_MIN_BYTES", 1024))
+
+def _compress_fields(doc):
+    if not DB_COMPRESS_MIN_BYTES:
+        return doc
+    doc = dict(doc)
+    for field in COMPRESSED_FIELDS:
+        value = doc.get(field)
+        if isinstance(value, str) and len(value) >= DB_COMPRESS_MIN_BYTES:
+            doc[field] = zlib.compress(value.encode("utf-8"))  # Stored as BSON binary
+    return doc
+
+def _decompress_fields(doc):
+    if doc:
+        for field in COMPRESSED_FIELDS:
+            if isinstance(doc.get(field), bytes):
+                doc[field] = zlib.decompress(doc[field]).decode("utf-8")
+    return doc
+
+def _projection(fields):
+    """Mongo projection for the given field names, or None for whole documents."""
+    return None if fields is None else {"_id": 0, **{field: 1 for field in fields}}
+
+def _pick(doc, fields):
+    if doc is None or fields is None:
+        return doc
+    return {field: doc[field] for field in fields if field in doc}
+
 class MongoDBManager:
     _instance = None
 
@@ -29,23 +96,29 @@ class MongoDBManager:
         return cls._instance
 
     def _connect(self):
-        # If pymongo is not installed, avoid attempting a DB connection
-        if MongoClient is None:
-            print("pymongo not installed — using no-op in-memory DB manager")
-            self.client = None
-            self.db = None
-            self._store = {"articles": {}, "lyrics": {}}
-            return
+        # Exactly one backend is set: self.db (MongoDB) or self.local (SQLite)
+        self.client = None
+        self.db = None
+        self.local = None
+        if DB_BACKEND != "sqlite":
+            # If pymongo is not installed, avoid attempting a DB connection
+            if MongoClient is None:
+                print("pymongo not installed")
+            else:
+                try:
+                    self.client = MongoClient(MONGO_URL)
+                    self.db = self.client[DB_NAME]
+                    print(f"Connected to MongoDB: {MONGO_URL}, database: {DB_NAME}")
+                    self._setup_indexes()
+                    return
+                except Exception as e:
+                    print(f"Error connecting to MongoDB: {e}")
+                    self.client = None
+                    self.db = None
 
-        try:
-            self.client = MongoClient(MONGO_URL)
-            self.db = self.client[DB_NAME]
-            print(f"Connected to MongoDB: {MONGO_URL}, database: {DB_NAME}")
-            self._setup_indexes()
-        except Exception as e:
-            print(f"Error connecting to MongoDB: {e}")
-            self.client = None
-            self.db = None
+        self.local = SQLiteStore(SQLITE_PATH, ttl=DB_TTL_DAYS * 24 * 60 * 60, history_max_rows=HISTORY_MAX_ROWS,
+                                 compress_min_bytes=DB_COMPRESS_MIN_BYTES)
+        print(f"Using SQLite database: {SQLITE_PATH}")
 
     def _setup_indexes(self):
         if self.db is not None:
@@ -53,10 +126,16 @@ class MongoDBManager:
             self.db.lyrics.create_index([("query", 1)], unique=True)
             self.db.lyrics.create_index([("timestamp", 1)], expireAfterSeconds=DB_TTL_DAYS * 24 * 60 * 60)
 
-            # Index for articles collection, unique by url, with TTL
+            # Index for articles collection, unique by url and by canonical key (see article_urls), with TTL.
+            # The key index is sparse: documents stored before keys existed are still found by url.
             self.db.articles.create_index([("url", 1)], unique=True)
+            self.db.articles.create_index([("key", 1)], unique=True, sparse=True)
             self.db.articles.create_index([("timestamp", 1)], expireAfterSeconds=DB_TTL_DAYS * 24 * 60 * 60)
 
+            # Negative cache, one entry per (kind, key); each entry expires at its own expires_at
+            self.db.misses.create_index([("kind", 1), ("key", 1)], unique=True)
+            self.db.misses.create_index([("expires_at", 1)], expireAfterSeconds=0)
+
             # Index for search history - ordered by timestamp
             self.db.search_history.create_index([("timestamp", -1)])
             self.db.search_history.create_index([("type", 1), ("timestamp", -1)])
@@ -68,50 +147,284 @@ class MongoDBManager:
 
             print("MongoDB TTL indexes created/updated.")
 
-    def get_lyrics(self, query):
-        if getattr(self, "db", None) is None:
-            return getattr(self, "_store", {}).get("lyrics", {}).get(query)
-        return self.db.lyrics.find_one({"query": query})
+    def _find_lyrics(self, key, fields=None):
+        if self.db is None:
+            return _pick(self.local.find_lyrics(key), fields)
+        return _decompress_fields(self.db.lyrics.find_one({"query": key}, _projection(fields)))
+
+    def get_lyrics(self, query, fuzzy=True, fields=None):
+        """
+        Lyrics stored under the normalized query, or under the exact query for documents saved
+        before normalization. With fuzzy, falls back to the closest stored query or title.
+        fields limits the returned document to those fields (without _id).
+        """
+        key = normalize_query(query) or query
+        doc = self._find_lyrics(key, fields)
+        if doc is None and key != query:
+            doc = self._find_lyrics(query, fields)
+        if doc is not None or not fuzzy:
+            return doc
+
+        index = self._lyrics_index()
+        match = index.best_match(key, LYRICS_FUZZY_THRESHOLD)
+        if match is None:
+            return None
+        doc = self._find_lyrics(match, fields)
+        if doc is None:
+            index.discard(match)  # Expired through the TTL index
+        return doc
+
+    def get_lyrics_titles(self, queries):
+        """
+        {query: stored title} for the queries that have lyrics, resolved like get_lyrics (normalized,
+        then exact, then fuzzy) but in at most two round-trips that only read titles.
+        """
+        keys = {}
+        for query in queries:
+            if query:
+                keys.setdefault(normalize_query(query) or query, []).append(query)
+                keys.setdefault(query, []).append(query)
+        titles = {}
+
+        def resolve(wanted):
+            for doc in self._find_lyrics_titles(list(wanted)):
+                for query in wanted[doc["query"]]:
+                    if doc.get("title"):
+                        titles.setdefault(query, doc["title"])
+
+        resolve(keys)
+        unresolved = {normalize_query(q) or q: q for q in queries if q and q not in titles}
+        if unresolved:
+            index = self._lyrics_index()
+            fuzzy = {}
+            for key, query in unresolved.items():
+                match = index.best_match(key, LYRICS_FUZZY_THRESHOLD)
+                if match is not None:
+                    fuzzy.setdefault(match, []).append(query)
+            if fuzzy:
+                resolve(fuzzy)
+        return titles
+
+    def _find_lyrics_titles(self, keys):
+        if self.db is None:
+            return self.local.find_lyrics_titles(keys)
+        return self.db.lyrics.find({"query": {"$in": keys}}, {"_id": 0, "query": 1, "title": 1})
 
     def save_lyrics(self, query, lyrics_data):
-        if getattr(self, "db", None) is None:
-            self._store.setdefault("lyrics", {})[query] = {**lyrics_data, "query": query}
+        key = normalize_query(query) or query
+        self._lyrics_index().add(key, key, lyrics_data.get("title"), lyrics_data.get("artist"))
+        self.clear_miss("lyrics", key)
+        if self.db is None:
+            self.local.save_lyrics(key, lyrics_data)
             return
-        self.db.lyrics.update_one({"query": query}, {"$set": {**lyrics_data, "query": query, "timestamp": datetime.now()}}, upsert=True)
+        self.db.lyrics.update_one({"query": key}, {"$set": {**_compress_fields(lyrics_data), "query": key, "timestamp": datetime.now()}}, upsert=True)
+
+    def load_lyrics_index(self):
+        """Build the fuzzy lyrics index now, e.g. in a worker parent so forked job processes inherit it."""
+        self._lyrics_index()
+
+    def _lyrics_index(self):
+        """The fuzzy lyrics index, built from the stored queries/titles and topped up with newer documents."""
+        if getattr(self, "_index", None) is None:
+            self._index = QueryIndex()
+            self._index_lock = threading.Lock()
+            self._index_loaded_at = 0.0
+            self._index_since = None
+        if time.time() - self._index_loaded_at < LYRICS_INDEX_REFRESH:
+            return self._index
 
-    def get_article(self, url):
-        if getattr(self, "db", None) is None:
-            return getattr(self, "_store", {}).get("articles", {}).get(url)
-        return self.db.articles.find_one({"url": url})
+        with self._index_lock:
+            if time.time() - self._index_loaded_at < LYRICS_INDEX_REFRESH:
+                return self._index
+            query_filter = {"timestamp": {"$gt": self._index_since}} if self._index_since else {}
+            try:
+                if self.db is None:
+                    cursor = self.local.lyrics_since(self._index_since)
+                else:
+                    cursor = self.db.lyrics.find(query_filter, {"_id": 0, "query": 1, "title": 1, "artist": 1, "timestamp": 1})
+                for doc in cursor:
+                    self._index.add(doc["query"], doc["query"], doc.get("title"), doc.get("artist"))
+                    if doc.get("timestamp") and (self._index_since is None or doc["timestamp"] > self._index_since):
+                        self._index_since = doc["timestamp"]
+            except Exception as e:
+                print(f"Could not refresh the lyrics index: {e}")
+            self._index_loaded_at = time.time()
+        return self._index
+
+    def get_article(self, url, fields=None):
+        """
+        The stored article for url or any equivalent link (tracking params, Freedium mirror, ...).
+        fields limits the returned document to those fields (without _id), e.g. ["title"].
+        """
+        key = article_key(url)
+        if self.db is None:
+            return _pick(self.local.find_article(key, url), fields)
+        return _decompress_fields(self.db.articles.find_one({"$or": [{"key": key}, {"url": url}]}, _projection(fields)))
+
+    def get_article_titles(self, urls):
+        """{url: stored title} for the urls (or equivalent links) that have an article, in one round-trip."""
+        keys = {}
+        for url in urls:
+            if url:
+                keys.setdefault(article_key(url), []).append(url)
+        if not keys:
+            return {}
+        if self.db is None:
+            docs = self.local.find_article_titles(list(keys))
+        else:
+            raw_urls = [u for u in urls if u]
+            docs = self.db.articles.find({"$or": [{"key": {"$in": list(keys)}}, {"url": {"$in": raw_urls}}]},
+                                         {"_id": 0, "key": 1, "url": 1, "title": 1})
+        titles = {}
+        for doc in docs:
+            if not doc.get("title"):
+                continue
+            # Documents stored before keys existed only have their url
+            for url in keys.get(doc.get("key") or article_key(doc.get("url", "")), []):
+                titles.setdefault(url, doc["title"])
+        return titles
 
     def save_article(self, url, article_data):
-        if getattr(self, "db", None) is None:
-            self._store.setdefault("articles", {})[url] = {**article_data, "url": url}
+        key = article_key(url)
+        self.clear_miss("article", key)
+        article_data = {k: v for k, v in article_data.items() if k not in ("_id", "url")}
+        if self.db is None:
+            self.local.save_article(key, url, article_data)
+            return
+        # The first URL an article was stored under stays
+        update = {"$set": {**_compress_fields(article_data), "key": key, "timestamp": datetime.now()}}
+        if self.db.articles.find_one({"key": key}, {"_id": 1}) is None:
+            try:
+                # A legacy document stored by url (no key, or one derived by older rules) gains the key
+                self.db.articles.update_one({"url": url}, update, upsert=True)
+                return
+            except DuplicateKeyError:
+                pass  # Another process stored the keyed document meanwhile
+        self.db.articles.update_one({"key": key}, update)
+        # A legacy copy stored by this url is now shadowed by the keyed document
+        self.db.articles.delete_many({"url": url, "key": {"$ne": key}})
+
+    def get_miss(self, kind, key):
+        """The unexpired negative-cache entry for (kind, key), e.g. ("lyrics", normalized query), or None."""
+        if self.db is None:
+            miss = self.local.find_miss(kind, key)
+        else:
+            miss = self.db.misses.find_one({"kind": kind, "key": key}, {"_id": 0})
+        # Expired entries are only deleted periodically (Mongo's TTL monitor, the SQLite purge), so check ourselves
+        if miss and miss["expires_at"] > datetime.now():
+            return miss
+        return None
+
+    def record_miss(self, kind, key, reason="not_found", ttl=None):
+        """Remembers that a lookup found nothing, for NEGATIVE_TTL ("not_found") or NEGATIVE_ERROR_TTL seconds."""
+        if ttl is None:
+            ttl = NEGATIVE_TTL if reason == "not_found" else NEGATIVE_ERROR_TTL
+        now = datetime.now()
+        miss = {"kind": kind, "key": key, "reason": reason, "timestamp": now, "expires_at": now + timedelta(seconds=ttl)}
+        if self.db is None:
+            self.local.save_miss(miss)
             return
-        self.db.articles.update_one({"url": url}, {"$set": {**article_data, "url": url, "timestamp": datetime.now()}}, upsert=True)
+        self.db.misses.update_one({"kind": kind, "key": key}, {"$set": miss}, upsert=True)
+
+    def clear_miss(self, kind, key):
+        if self.db is None:
+            self.local.delete_miss(kind, key)
+            return
+        self.db.misses.delete_one({"kind": kind, "key": key})
 
     def add_to_search_history(self, search_type, query, metadata=None):
-        if self.db is None: return
-        history_entry = {
-            "type": search_type,  # 'lyrics', 'medium', 'simpmusic'
-            "query": query,
-            "timestamp": datetime.now(),
-            "metadata": metadata or {}
-        }
-        self.db.search_history.insert_one(history_entry)
+        now = datetime.now()
+        with self._history_state():
+            buffer = self._history_buffer
+            last = buffer[-1] if buffer else None
+            if last is not None and (last["type"], last["query"]) == (search_type, query):
+                # Same search again: one row with a count, carrying the newest time and any new metadata
+                last["count"] += 1
+                last["timestamp"] = now
+                last["metadata"].update(metadata or {})
+            else:
+                buffer.append({
+                    "type": search_type,  # 'lyrics', 'medium', 'simpmusic'
+                    "query": query,
+                    "timestamp": now,
+                    "metadata": dict(metadata or {}),
+                    "count": 1,
+                })
+            full = len(buffer) >= HISTORY_FLUSH_SIZE
+        if full:
+            self.flush_search_history()
+
+    def _history_state(self):
+        """The lock guarding the history buffer; sets up the buffer and its flusher on first use in a process."""
+        if getattr(self, "_history_pid", None) != os.getpid():
+            # A forked child starts with an empty buffer of its own; the parent flushes what it held
+            self._history_lock = threading.Lock()
+            self._history_flush_lock = threading.Lock()  # Keeps flushes, and so rows, in order
+            self._history_buffer = []
+            self._history_pid = os.getpid()
+            threading.Thread(target=self._history_flush_loop, args=(os.getpid(),), daemon=True).start()
+            atexit.register(self.flush_search_history)
+        return self._history_lock
+
+    def _history_flush_loop(self, pid):
+        while self._history_pid == pid:
+            time.sleep(HISTORY_FLUSH_INTERVAL)
+            self.flush_search_history()
+
+    def flush_search_history(self):
+        """Writes the buffered history entries: an update for a repeat of the newest stored row, one insert_many for the rest."""
+        lock = self._history_state()
+        with self._history_flush_lock:
+            with lock:
+                entries, self._history_buffer = self._history_buffer, []
+            if not entries:
+                return
+            try:
+                self._write_search_history(entries)
+            except Exception as e:
+                print(f"Failed to write {len(entries)} search history entries: {e}")
+
+    def _write_search_history(self, entries):
+        if self.db is None:
+            self.local.write_history(entries)
+            return
+        first = entries[0]
+        latest = self.db.search_history.find_one({}, {"type": 1, "query": 1}, sort=[("timestamp", -1)])
+        if latest and (latest.get("type"), latest.get("query")) == (first["type"], first["query"]):
+            # $literal, so a title starting with "$" isn't read as a field path
+            fields = {f"metadata.{k}": {"$literal": v} for k, v in first["metadata"].items()}
+            fields["timestamp"] = {"$literal": first["timestamp"]}
+            # Rows written before counts existed stand for one search
+            fields["count"] = {"$add": [{"$ifNull": ["$count", 1]}, first["count"]]}
+            self.db.search_history.update_one({"_id": latest["_id"]}, [{"$set": fields}])
+            entries = entries[1:]
+        if entries:
+            self.db.search_history.insert_many(entries, ordered=True)
+        self._trim_search_history()
+
+    def _trim_search_history(self):
+        oldest_kept = list(self.db.search_history.find({}, {"timestamp": 1}).sort("timestamp", -1).skip(HISTORY_MAX_ROWS - 1).limit(1))
+        if oldest_kept:
+            self.db.search_history.delete_many({"timestamp": {"$lt": oldest_kept[0]["timestamp"]}})
 
     def get_search_history(self, search_type=None, limit=20):
-        if self.db is None: return []
+        # Read your own writes: whatever this process buffered is written first
+        self.flush_search_history()
+        if self.db is None:
+            return self.local.get_history(search_type, limit)
         query_filter = {"type": search_type} if search_type else {}
         return list(self.db.search_history.find(query_filter).sort("timestamp", -1).limit(limit))
 
     def clear_search_history(self, search_type=None):
-        if self.db is None: return
+        with self._history_state():
+            self._history_buffer = [e for e in self._history_buffer if search_type and e["type"] != search_type]
+        if self.db is None:
+            self.local.clear_history(search_type)
+            return
         query_filter = {"type": search_type} if search_type else {}
         self.db.search_history.delete_many(query_filter)
 
     def add_to_favorites(self, item_type, item_id, title, metadata=None):
-        if self.db is None: return
         favorite_entry = {
             "type": item_type,  # 'lyrics', 'medium'
             "item_id": item_id,  # url or query
@@ -119,6 +432,9 @@ class MongoDBManager:
             "timestamp": datetime.now(),
             "metadata": metadata or {}
         }
+        if self.db is None:
+            self.local.save_favorite(favorite_entry)
+            return
         self.db.favorites.update_one(
             {"item_id": item_id},
             {"$set": favorite_entry},
@@ -126,17 +442,22 @@ class MongoDBManager:
         )
 
     def remove_from_favorites(self, item_id):
-        if self.db is None: return
+        if self.db is None:
+            self.local.delete_favorite(item_id)
+            return
         self.db.favorites.delete_one({"item_id": item_id})
 
     def get_favorites(self, item_type=None, limit=100):
-        if self.db is None: return []
+        if self.db is None:
+            return self.local.get_favorites(item_type, limit)
         query_filter = {"type": item_type} if item_type else {}
         return list(self.db.favorites.find(query_filter).sort("timestamp", -1).limit(limit))
 
     def is_favorite(self, item_id):
-        if self.db is None: return False
-        return self.db.favorites.find_one({"item_id": item_id}) is not None
+        if self.db is None:
+            return self.local.is_favorite(item_id)
+        # Covered by the unique item_id index: answered from the index without loading the document
+        return self.db.favorites.find_one({"item_id": item_id}, {"_id": 0, "item_id": 1}) is not None
 
 # Initialize the DB manager globally
 db_manager = MongoDBManager()
\ No newline at end of file
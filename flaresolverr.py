@@ -0,0 +1,250 @@
+import json
+import time
+import hashlib
+import threading
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+
+# Redis keys shared by all workers
+SESSIONS_KEY = "flaresolverr:sessions"  # hash: session id -> last used (epoch seconds)
+CLEARANCE_KEY_PREFIX = "flaresolverr:clearance:"  # per host: solved cookies, user agent and proxy
+
+CHALLENGE_MARKERS = ("cf-chl", "challenge-platform", "<title>Just a moment...</title>")
+
+
+def host_of(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+
+def looks_like_challenge(response) -> bool:
+    """True if a direct response is a Cloudflare challenge rather than the page itself."""
+    if response.headers.get("cf-mitigated") == "challenge":
+        return True
+    if response.status_code not in (403, 429, 503):
+        return False
+    head = response.text[:20000]
+    return any(marker in head for marker in CHALLENGE_MARKERS)
+
+
+class FlareSolverrClient:
+    """
+    FlareSolverr client that keeps one browser session per (host, proxy) and remembers the
+    solved Cloudflare clearance (cookies + user agent) per host.
+
+    Session ids are derived from (host, proxy), so every worker process addresses the same
+    FlareSolverr session without coordination; the last-used times in Redis (or in process
+    memory without Redis) drive idle cleanup and the session cap. The clearance lets callers
+    replay cheap direct requests until it expires instead of going through the browser.
+    """
+
+    def __init__(self, url: Optional[str], session_getter: Callable, redis_client=None,
+                 max_sessions: int = 8, session_idle_ttl: int = 600, clearance_ttl: int = 1200,
+                 max_concurrency: int = 4):
+        self.url = url
+        self.session_getter = session_getter
+        self.redis = redis_client
+        self.max_sessions = max_sessions
+        self.session_idle_ttl = session_idle_ttl
+        self.clearance_ttl = clearance_ttl
+
+        self._lock = threading.Lock()
+        # Commands in flight from this process; waiting for a slot counts against the caller's timeout
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._local_sessions: Dict[str, float] = {}
+        self._local_clearance: Dict[str, Dict] = {}
+
+    # -- FlareSolverr commands -----------------------------------------------
+
+    def _command(self, payload: Dict, timeout: float) -> Dict:
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=timeout):
+            raise requests.exceptions.Timeout(f"No free FlareSolverr slot within {timeout:.1f}s")
+        try:
+            remaining = max(1.0, timeout - (time.monotonic() - started))
+            r = self.session_getter().post(self.url, json=payload, timeout=remaining)
+            r.raise_for_status()
+            return r.json()
+        finally:
+            self._slots.release()
+
+    def request_get(self, url: str, proxy: Optional[str] = None, max_timeout: int = 30000,
+                    timeout: float = 60) -> Dict:
+        """
+        Runs request.get inside the (host, proxy) browser session, creating it if needed, and
+        stores the clearance from an ok solution. Falls back to a stateless request if the
+        session can't be used. Returns FlareSolverr's JSON reply.
+        """
+        host = host_of(url)
+        payload = {"cmd": "request.get", "url": url, "maxTimeout": max_timeout}
+        session_id = self._ensure_session(host, proxy, timeout)
+        if session_id:
+            payload["session"] = session_id
+        elif proxy:
+            payload["proxy"] = {"url": f"http://{proxy}"}
+
+        data = self._command(payload, timeout)
+        if session_id and data.get("status") != "ok" and "session" in str(data.get("message", "")).lower():
+            # The session was destroyed behind our back (FlareSolverr restart); retry statelessly once
+            self._forget_session(session_id)
+            payload.pop("session", None)
+            if proxy:
+                payload["proxy"] = {"url": f"http://{proxy}"}
+            data = self._command(payload, timeout)
+
+        if data.get("status") == "ok":
+            if session_id:
+                self._touch_session(session_id)
+            self._store_clearance(host, proxy, data.get("solution") or {})
+        return data
+
+    @staticmethod
+    def session_id_for(host: str, proxy: Optional[str]) -> str:
+        return "scrapper-" + hashlib.sha1(f"{host}|{proxy or 'direct'}".encode()).hexdigest()[:16]
+
+    def _ensure_session(self, host: str, proxy: Optional[str], timeout: float) -> Optional[str]:
+        session_id = self.session_id_for(host, proxy)
+        last_used = self._session_last_used(session_id)
+        if last_used and time.time() - last_used < self.session_idle_ttl:
+            return session_id
+
+        self._reap_sessions()
+        payload = {"cmd": "sessions.create", "session": session_id}
+        if proxy:
+            payload["proxy"] = {"url": f"http://{proxy}"}
+        try:
+            # "Session already exists" is also reported as ok, which is what we want
+            data = self._command(payload, timeout)
+        except Exception as e:
+            print(f"Could not create FlareSolverr session for {host}: {e}")
+            return None
+        if data.get("status") != "ok":
+            print(f"FlareSolverr refused session for {host}: {data.get('message')}")
+            return None
+        self._touch_session(session_id)
+        return session_id
+
+    def _reap_sessions(self) -> None:
+        """Destroys sessions idle longer than session_idle_ttl, then the oldest beyond max_sessions."""
+        sessions = self._all_sessions()
+        now = time.time()
+        expired = [sid for sid, used in sessions.items() if now - used > self.session_idle_ttl]
+        live = sorted((used, sid) for sid, used in sessions.items() if sid not in expired)
+        # Leave room for the session about to be created
+        while len(live) >= self.max_sessions:
+            expired.append(live.pop(0)[1])
+        for sid in expired:
+            self.destroy_session(sid)
+
+    def destroy_session(self, session_id: str) -> None:
+        self._forget_session(session_id)
+        try:
+            self._command({"cmd": "sessions.destroy", "session": session_id}, timeout=30)
+        except Exception as e:
+            print(f"Could not destroy FlareSolverr session {session_id}: {e}")
+
+    def close(self) -> None:
+        """Destroys every session this deployment created."""
+        for session_id in list(self._all_sessions()):
+            self.destroy_session(session_id)
+
+    # -- session bookkeeping ---------------------------------------------------
+
+    def _session_last_used(self, session_id: str) -> Optional[float]:
+        if self.redis is not None:
+            try:
+                value = self.redis.hget(SESSIONS_KEY, session_id)
+                return float(value) if value else None
+            except Exception:
+                pass
+        with self._lock:
+            return self._local_sessions.get(session_id)
+
+    def _touch_session(self, session_id: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._local_sessions[session_id] = now
+        if self.redis is not None:
+            try:
+                self.redis.hset(SESSIONS_KEY, session_id, now)
+            except Exception:
+                pass
+
+    def _forget_session(self, session_id: str) -> None:
+        with self._lock:
+            self._local_sessions.pop(session_id, None)
+        if self.redis is not None:
+            try:
+                self.redis.hdel(SESSIONS_KEY, session_id)
+            except Exception:
+                pass
+
+    def _all_sessions(self) -> Dict[str, float]:
+        if self.redis is not None:
+            try:
+                return {(k.decode() if isinstance(k, bytes) else k): float(v)
+                        for k, v in self.redis.hgetall(SESSIONS_KEY).items()}
+            except Exception:
+                pass
+        with self._lock:
+            return dict(self._local_sessions)
+
+    # -- clearance -------------------------------------------------------------
+
+    def _store_clearance(self, host: str, proxy: Optional[str], solution: Dict) -> None:
+        cookies = solution.get("cookies") or []
+        user_agent = solution.get("userAgent")
+        if not cookies or not user_agent:
+            return
+        expires_at = time.time() + self.clearance_ttl
+        for cookie in cookies:
+            # Never trust the clearance past the expiry Cloudflare put on its own cookie
+            if cookie.get("name") == "cf_clearance" and (cookie.get("expires") or -1) > 0:
+                expires_at = min(expires_at, float(cookie["expires"]))
+        ttl = int(expires_at - time.time())
+        if ttl <= 0:
+            return
+        clearance = {
+            "proxy": proxy,
+            "user_agent": user_agent,
+            "cookies": {c["name"]: c["value"] for c in cookies if "name" in c and "value" in c},
+            "expires_at": expires_at,
+        }
+        with self._lock:
+            self._local_clearance[host] = clearance
+        if self.redis is not None:
+            try:
+                self.redis.set(CLEARANCE_KEY_PREFIX + host, json.dumps(clearance), ex=ttl)
+            except Exception:
+                pass
+
+    def clearance(self, host: str) -> Optional[Dict]:
+        """The latest unexpired clearance for host: {"proxy", "user_agent", "cookies", "expires_at"}."""
+        clearance = None
+        if self.redis is not None:
+            try:
+                raw = self.redis.get(CLEARANCE_KEY_PREFIX + host)
+                clearance = json.loads(raw) if raw else None
+            except Exception:
+                clearance = None
+        if clearance is None:
+            with self._lock:
+                clearance = self._local_clearance.get(host)
+        if clearance and clearance["expires_at"] > time.time():
+            return clearance
+        return None
+
+    def invalidate_clearance(self, host: str) -> None:
+        with self._lock:
+            self._local_clearance.pop(host, None)
+        if self.redis is not None:
+            try:
+                self.redis.delete(CLEARANCE_KEY_PREFIX + host)
+            except Exception:
+                pass
+
+    def replay_headers(self, clearance: Dict) -> Tuple[Dict, Dict]:
+        """Headers and cookies that make a direct request look like the browser that solved the challenge."""
+        headers = {"User-Agent": clearance["user_agent"]}
+        return headers, dict(clearance["cookies"])
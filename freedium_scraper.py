@@ -1,17 +1,29 @@
 import os
 from typing import List, Dict
-import requests
-from bs4 import BeautifulSoup
 from concurrent.futures import ThreadPoolExecutor
-from common import fetch_with_flaresolverr, get_random_proxy
+from article_urls import article_key, clean_article_url
+from common import cached_page, fetch_with_flaresolverr, get_session, parse_cache
 from db import db_manager
+from html_parsing import HTML_PARSER, parse_html
+from parse_cache import fingerprint
+
+# Bump when parse_article changes; see medium_scraper.MEDIUM_EXTRACTOR_VERSION
+FREEDIUM_EXTRACTOR = "freedium_article"
+FREEDIUM_EXTRACTOR_VERSION = f"1-{fingerprint(HTML_PARSER)}"
+
+
+def is_current_article(article: Dict) -> bool:
+    """False for a stored article this extractor produced at an older version; Medium's copies are current."""
+    return article.get("extractor", FREEDIUM_EXTRACTOR) != FREEDIUM_EXTRACTOR or \
+        article.get("extractor_version") == FREEDIUM_EXTRACTOR_VERSION
 
 
 class FreediumScraper:
     def __init__(self, concurrency: int = 4):
         self.concurrency = concurrency
         self.flaresolverr_url = os.getenv("FLARE_URL")
-        self.session = requests.Session()
+        # Shared pooled session, so connections outlive this scraper instance
+        self.session = get_session()
         self.headers = {
             "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36",
             "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
@@ -19,7 +31,7 @@ class FreediumScraper:
         }
 
     def parse_article(self, html: str) -> Dict:
-        soup = BeautifulSoup(html, "html.parser")
+        soup = parse_html(html, only=["h1", "a", "div.mt-8.main-content", "p"])
 
         # Title
         title_tag = soup.find("h1", class_ = "pt-6 pb-2 font-sans text-3xl font-bold text-gray-900 break-normal dark:text-gray-100 md:text-4xl")
@@ -48,20 +60,42 @@ class FreediumScraper:
 
         return {"title": title, "author": author, "content": content}
 
+    def _parse(self, html: str) -> Dict:
+        article = parse_cache.get_or_parse(html, FREEDIUM_EXTRACTOR, FREEDIUM_EXTRACTOR_VERSION, self.parse_article)
+        if article is not None:
+            article.update({"extractor": FREEDIUM_EXTRACTOR, "extractor_version": FREEDIUM_EXTRACTOR_VERSION})
+        return article
+
     def scrape_single(self, url: str) -> Dict:
         # Check DB cache first
         cached = db_manager.get_article(url)
         if cached:
             cached.pop("_id", None)
-            return cached
+            if is_current_article(cached):
+                return cached
+            # Parsed by an older extractor: re-derive it from the cached page, if that's still on disk
+            html = cached_page(clean_article_url(url))
+            article = self._parse(html) if html else None
+            if not article:
+                return cached
+            article["url"] = url
+            db_manager.save_article(url, article)
+            return article
+
+        if db_manager.get_miss("article", article_key(url)):
+            return {"error": "Failed to fetch article content recently; try again later."}
 
-        html, _ = fetch_with_flaresolverr(url)
+        html, _ = fetch_with_flaresolverr(clean_article_url(url), source="article")
         if not html:
+            db_manager.record_miss("article", article_key(url), "unavailable")
             return {"error": "Failed to fetch article content."}
 
-        article = self.parse_article(html)
-        title = article.get("title", "")
-        db_manager.save_article(title, article)
+        article = self._parse(html)
+        if not article:
+            return {"error": "Could not find a Freedium article on this page."}
+        article["url"] = url
+        # Stored under the article's canonical key, so the lookup above finds it next time
+        db_manager.save_article(url, article)
         return article
 
     def scrape_bulk(self, urls: List[str]) -> List[Dict]:
@@ -0,0 +1,144 @@
+import os
+import re
+from html.parser import HTMLParser
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from bs4 import BeautifulSoup, FeatureNotFound, SoupStrainer
+
+try:
+    import lxml  # noqa: F401  (C-backed tree builder, several times faster than html.parser)
+    _DEFAULT_PARSER = "lxml"
+except ImportError:
+    _DEFAULT_PARSER = "html.parser"
+
+# Tree builder for every scraper: "lxml" when installed, otherwise Python's html.parser.
+# Set HTML_PARSER=html.parser to get the original behaviour back.
+HTML_PARSER = os.environ.get("HTML_PARSER", _DEFAULT_PARSER)
+# Build only the subtrees a scraper reads (see parse_html's only=); 0 parses whole documents
+PARTIAL_PARSE = os.environ.get("PARTIAL_PARSE", "1").lower() not in ("0", "false", "no")
+
+_COMPOUND = re.compile(r"^([a-zA-Z][\w-]*|\*)?((?:\.[\w-]+|\[[\w-]+(?:=[^\]]*)?\])*)$")
+_PART = re.compile(r"\.([\w-]+)|\[([\w-]+)(?:=([^\]]*))?\]")
+
+Rule = Tuple[Optional[str], Tuple[str, ...], Dict[str, Optional[str]]]
+
+
+def selector_rule(selector: str) -> Rule:
+    """
+    (tag, classes, attrs) for the outermost compound of a CSS selector such as
+    "div.row.item-list p.item-title" or "section[data-field=body]". Whatever the full
+    selector matches lies inside an element this rule keeps.
+    """
+    first = selector.strip().split()[0]
+    match = _COMPOUND.match(first)
+    if not match:
+        raise ValueError(f"Unsupported selector for partial parsing: {selector!r}")
+    tag = match.group(1) if match.group(1) not in (None, "*") else None
+    classes, attrs = [], {}
+    for cls, attr, value in _PART.findall(match.group(2)):
+        if cls:
+            classes.append(cls)
+        else:
+            attrs[attr] = value.strip("'\"") if value else None
+    return tag, tuple(classes), attrs
+
+
+class AnyOfStrainer(SoupStrainer):
+    """Keeps every element matching any of the selectors, with its whole subtree."""
+
+    def __init__(self, selectors: Iterable[str]):
+        # A name rule makes the base class drop stray top-level strings, as a tag-only strainer should
+        super().__init__(name=True)
+        self.rules: List[Rule] = [selector_rule(s) for s in selectors]
+
+    @staticmethod
+    def _rule_matches(rule: Rule, name: str, attrs) -> bool:
+        tag, required_classes, required_attrs = rule
+        if tag and tag != name:
+            return False
+        classes = attrs.get("class") or ""
+        classes = set(classes.split() if isinstance(classes, str) else classes)
+        if not classes.issuperset(required_classes):
+            return False
+        return all(attr in attrs and (value is None or attrs[attr] == value) for attr, value in required_attrs.items())
+
+    def _matches(self, name: str, attrs) -> bool:
+        attrs = dict(attrs or {})
+        return any(self._rule_matches(rule, name, attrs) for rule in self.rules)
+
+    # Beautiful Soup >= 4.13
+    def allow_tag_creation(self, nsprefix, name, attrs) -> bool:
+        return self._matches(name, attrs)
+
+    # Beautiful Soup < 4.13
+    def search_tag(self, markup_name=None, markup_attrs={}):
+        if isinstance(markup_name, str):
+            return self._matches(markup_name, markup_attrs)
+        return super().search_tag(markup_name, markup_attrs)
+
+
+def parse_html(html: str, only: Optional[Iterable[str]] = None) -> BeautifulSoup:
+    """
+    Parses html with HTML_PARSER. With only (CSS selectors), and PARTIAL_PARSE on, just the
+    elements matching one of them are built, so find()/select() for those selectors return
+    the same elements as on the full document at a fraction of the cost.
+    """
+    parse_only = AnyOfStrainer(only) if only and PARTIAL_PARSE else None
+    try:
+        return BeautifulSoup(html, HTML_PARSER, parse_only=parse_only)
+    except FeatureNotFound:
+        return BeautifulSoup(html, "html.parser", parse_only=parse_only)
+
+
+_VOID_ELEMENTS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+
+class TargetWatcher(HTMLParser):
+    """
+    Incremental scan of a page as it downloads that reports when the first element matching
+    each selector has been closed, i.e. when everything a scraper reads is already in the
+    buffer. Only plain compound selectors ("div.col-8", "table.table") can complete; a
+    selector with descendants never does, so its page is always read to the end.
+    """
+
+    def __init__(self, selectors: Iterable[str]):
+        super().__init__(convert_charrefs=False)
+        self._pending = {}
+        for selector in selectors:
+            if len(selector.split()) == 1:
+                self._pending[selector] = selector_rule(selector)
+            else:
+                self._pending[selector] = None  # Can't tell from the outer element alone
+        self._open: Dict[str, List] = {}  # selector -> [tag, nesting depth]
+
+    @property
+    def complete(self) -> bool:
+        return not self._pending
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        for selector, state in self._open.items():
+            if state[0] == tag:
+                state[1] += 1
+        for selector, rule in list(self._pending.items()):
+            if rule is None or selector in self._open:
+                continue
+            if AnyOfStrainer._rule_matches(rule, tag, attrs):
+                if tag in _VOID_ELEMENTS:
+                    del self._pending[selector]
+                else:
+                    self._open[selector] = [tag, 1]
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in _VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        for selector, state in list(self._open.items()):
+            if state[0] != tag:
+                continue
+            state[1] -= 1
+            if state[1] == 0:
+                del self._open[selector]
+                self._pending.pop(selector, None)
@@ -1,7 +1,14 @@
-import requests
-from bs4 import BeautifulSoup
+import os
+import time
+import threading
 from urllib.parse import urljoin, quote
-from common import fetch_with_flaresolverr # For raw HTML caching
+from collections import deque
+from common import fetch_with_flaresolverr, get_redis, get_session, parse_cache, rate_limiter # For raw HTML caching
+from site_stats import SiteStats
+from html_parsing import HTML_PARSER, parse_html
+from parse_cache import fingerprint
+from query_index import normalize_query
+from simpmusic import SimpMusicClient, SimpMusicError, to_lyrics
 import concurrent.futures
 
 SITES = {
@@ -36,29 +43,194 @@ SITES = {
 
 from db import db_manager # Import the database manager
 
+# Bump when the extraction code below changes; cached parse results of older versions are then ignored.
+# A site's selectors and the tree builder are part of its version too (see _extractor_version).
+LYRICS_EXTRACTOR_VERSION = 1
 
-def search_song(query):
+SIMPMUSIC_URL = os.environ.get("SIMPMUSIC_URL", "https://api-lyrics.simpmusic.org/v1/search")
+SIMPMUSIC_CACHE_TTL = int(os.environ.get("SIMPMUSIC_CACHE_TTL", 3600))  # seconds an API response is reused
+SIMPMUSIC_BATCH_CONCURRENCY = int(os.environ.get("SIMPMUSIC_BATCH_CONCURRENCY", 4))
+
+LYRICS_DEADLINE = float(os.environ.get("LYRICS_DEADLINE", 60))  # overall budget for search_song, seconds
+LYRICS_SITE_TIMEOUT = float(os.environ.get("LYRICS_SITE_TIMEOUT", 45))  # a site slower than this is ignored
+# How long the best site gets before the next one is started, while it has no latency history
+LYRICS_HEDGE_DELAY = float(os.environ.get("LYRICS_HEDGE_DELAY", 5))
+# Let sites that lost the race finish their fetches anyway, only to fill the HTML cache.
+# Only useful where the process outlives the job (RQ_WORKER_MODE=simple or the web app):
+# a forked job process exits as soon as search_song returns.
+LYRICS_WARM_LOSERS = os.environ.get("LYRICS_WARM_LOSERS", "").lower() in ("1", "true", "yes")
+
+# Responses cached and Retry-After shared through Redis; requests share the per-host rate limiter budget
+simpmusic = SimpMusicClient(SIMPMUSIC_URL, get_session, rate_limiter, get_redis(), cache_ttl=SIMPMUSIC_CACHE_TTL)
+
+# Hit rate and latency per site, shared by all workers through Redis
+site_stats = SiteStats(get_redis())
+
+_site_executor = None
+_site_executor_pid = None
+_site_executor_lock = threading.Lock()
+
+
+def _site_pool():
+    global _site_executor, _site_executor_pid
+    with _site_executor_lock:
+        if _site_executor is None or _site_executor_pid != os.getpid():
+            # Shared rather than per call, so returning early never waits for the losers to shut down
+            _site_executor = concurrent.futures.ThreadPoolExecutor(max_workers=16, thread_name_prefix="lyrics-site")
+            _site_executor_pid = os.getpid()
+    return _site_executor
+
+
+def _hedge_after(site_summary):
+    # Give a site its usual worst case (p95) before starting the next one, but never wait forever on it
+    p95 = site_summary.get("p95")
+    return min(p95, LYRICS_HEDGE_DELAY * 2) if p95 else LYRICS_HEDGE_DELAY
+
+
+def search_song(query, deadline=None, site_timeout=None, warm_losers=None):
     """
     Searches for a song across multiple sites and returns the first found lyrics.
+    Sites are tried best first by their recent hit rate and latency (site_stats); the next
+    site starts when the running ones miss or are slower than usual, so a typical lookup
+    touches one or two sites. Returns as soon as one site has lyrics; the others are
+    abandoned, or with warm_losers left to finish only to warm the cache. A site that
+    hasn't answered within site_timeout seconds is ignored, and the search gives up after
+    deadline seconds.
     """
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        future_to_site = {executor.submit(search_site, query, site, config): site for site, config in SITES.items()}
-        for future in concurrent.futures.as_completed(future_to_site):
-            result = future.result()
-            if result:
-                return result
-    return None
+    deadline = LYRICS_DEADLINE if deadline is None else deadline
+    site_timeout = LYRICS_SITE_TIMEOUT if site_timeout is None else site_timeout
+    warm_losers = LYRICS_WARM_LOSERS if warm_losers is None else warm_losers
+
+    if db_manager.get_miss("lyrics", normalize_query(query) or query):
+        print(f"Lyrics for '{query}' were recently not found; skipping the search")
+        return None
+
+    give_up_at = time.monotonic() + deadline
+    summary = site_stats.summary(SITES)
+    order = deque(site_stats.rank(SITES))
+    # Only a search where every site answered "no such song" is a real miss; errors and timeouts may pass
+    conclusive = len(order) == len(SITES)
+    cancel = threading.Event()
+    executor = _site_pool()
+    running = {}  # future -> (site, started, site deadline)
+    next_launch_at = time.monotonic()
+    try:
+        while True:
+            now = time.monotonic()
+            if now >= give_up_at:
+                break
+            for future, (site, _, site_deadline) in list(running.items()):
+                if now >= site_deadline:
+                    print(f"Lyrics search on {site} for '{query}' exceeded {site_timeout:.0f}s, ignoring it")
+                    _abandon(future, running, warm_losers)
+                    conclusive = False
+            if order and (not running or now >= next_launch_at):
+                site = order.popleft()
+                site_deadline = min(give_up_at, now + site_timeout)
+                # Losers kept for warming aren't held to the deadline; it only bounds how long we wait
+                future = executor.submit(search_site, query, site, SITES[site], cancel,
+                                         None if warm_losers else site_deadline)
+                running[future] = (site, now, site_deadline)
+                next_launch_at = now + _hedge_after(summary.get(site, {}))
+                continue
+            if not running:
+                break
+
+            wake_at = min([give_up_at] + [d for _, _, d in running.values()] + ([next_launch_at] if order else []))
+            done, _ = concurrent.futures.wait(list(running), timeout=max(0.0, wake_at - now),
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                site = running.pop(future)[0]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Lyrics search on {site} failed: {e}")
+                    conclusive = False
+                    continue
+                if result:
+                    # Only the winner is saved; losers finishing later must not overwrite it
+                    db_manager.save_lyrics(query, result)
+                    return result
+        if running or order:
+            print(f"Lyrics search for '{query}' timed out waiting on {sorted(s for s, _, _ in running.values())}")
+            conclusive = False
+        db_manager.record_miss("lyrics", normalize_query(query) or query, "not_found" if conclusive else "unavailable")
+        return None
+    finally:
+        if not warm_losers:
+            cancel.set()
+        for future in list(running):
+            _abandon(future, running, warm_losers)
+
+
+def _abandon(future, running, warm_losers):
+    site, started, _ = running.pop(future)
+    if warm_losers:
+        return  # It keeps running and records its real outcome when it finishes
+    if not future.cancel():
+        # Already running: record how long it had taken so far, so a site that got slow loses its rank
+        site_stats.record(site, "abandoned", time.monotonic() - started)
+
+
+class _SiteError(Exception):
+    """The site couldn't be fetched, as opposed to answering without the song."""
+
 
-def search_site(query, site_name, site_config):
-    return _search_scrape(query, site_config)
+def search_site(query, site_name, site_config, cancel=None, deadline=None):
+    started = time.monotonic()
+    try:
+        result = _search_scrape(query, site_config, cancel, deadline)
+    except Exception:
+        site_stats.record(site_name, "error", time.monotonic() - started)
+        raise
+    stopped = (cancel is not None and cancel.is_set()) or (deadline is not None and time.monotonic() >= deadline)
+    if not result and stopped:
+        return None  # Stopped early; already recorded as abandoned
+    site_stats.record(site_name, "hit" if result else "miss", time.monotonic() - started)
+    return result
 
-def _search_scrape(query, site_config):
+def _search_scrape(query, site_config, cancel=None, deadline=None):
+    """
+    Scrapes one site. cancel (a threading.Event) and deadline (time.monotonic() value) are
+    checked between fetches, so an abandoned site stops before requesting the song page.
+    Raises _SiteError if a page couldn't be fetched.
+    """
     search_url = site_config["search_url"].format(query=quote(query))
-    html_content, _ = fetch_with_flaresolverr(search_url)
+    html_content, _ = fetch_with_flaresolverr(search_url, source="lyrics_search", until=[site_config["result_selector"]])
     if not html_content:
+        raise _SiteError(f"could not fetch {search_url}")
+    if (cancel is not None and cancel.is_set()) or (deadline is not None and time.monotonic() >= deadline):
         return None
 
-    soup = BeautifulSoup(html_content, "html.parser")
+    href = parse_cache.get_or_parse(html_content, "lyrics_search", _extractor_version(site_config),
+                                    lambda html: _extract_song_link(html, site_config))
+    if not href:
+        return None
+
+    song_url = urljoin(search_url, href)
+    # The download stops once the title, artist and lyrics elements have arrived
+    song_html, _ = fetch_with_flaresolverr(song_url, source="lyrics_page", until=_song_selectors(site_config))
+    if not song_html:
+        raise _SiteError(f"could not fetch {song_url}")
+
+    song = parse_cache.get_or_parse(song_html, "lyrics_song", _extractor_version(site_config),
+                                    lambda html: _extract_song(html, site_config))
+    if song:
+        return {**song, "source": urljoin(song_url, '/')}
+    return None
+
+def _extractor_version(site_config):
+    return f"{LYRICS_EXTRACTOR_VERSION}-{fingerprint(site_config, HTML_PARSER)}"
+
+def _song_selectors(site_config):
+    selectors = [site_config["title_selector"], site_config["lyrics_container_selector"]]
+    if site_config.get("artist_selector"):
+        selectors.append(site_config["artist_selector"])
+    return selectors
+
+def _extract_song_link(html, site_config):
+    """href of the first search result, or None."""
+    soup = parse_html(html, only=[site_config["result_selector"]])
     container = soup.select_one(site_config["result_selector"])
     if not container:
         return None
@@ -66,13 +238,11 @@ def _search_scrape(query, site_config):
     link_tag = container.select_one(site_config["link_selector"])
     if not link_tag or not link_tag.has_attr('href'):
         return None
+    return link_tag["href"]
 
-    song_url = urljoin(search_url, link_tag["href"])
-    song_html, _ = fetch_with_flaresolverr(song_url)
-    if not song_html:
-        return None
-
-    song_soup = BeautifulSoup(song_html, "html.parser")
+def _extract_song(html, site_config):
+    """{"title", "artist", "lyrics"} from a song page, or None if it has no lyrics container."""
+    song_soup = parse_html(html, only=_song_selectors(site_config))
     
     # Use the configured title_selector instead of the generic <title> tag
     title_element = song_soup.select_one(site_config["title_selector"])
@@ -87,53 +257,71 @@ def _search_scrape(query, site_config):
     
     if lyrics_container:
         lyrics_text = lyrics_container.get_text(separator='\n', strip=True)
-        lyrics_data = {"title": title, "artist": artist, "lyrics": lyrics_text, "source": urljoin(song_url, '/')}
-        db_manager.save_lyrics(query, lyrics_data) # Save to DB
-        return lyrics_data
+        return {"title": title, "artist": artist, "lyrics": lyrics_text}
     return None
 
-def search_simpmusic_only(query, search_type="song"):
+def simpmusic_miss_key(query, search_type="song"):
+    return f"{search_type}:{normalize_query(query) or query}"
+
+def _simpmusic_result(query, search_type, matches, index=None):
+    """Lyrics from the chosen hit (default: the first with lyrics) plus a summary of every hit for follow-up selection."""
+    with_lyrics = [i for i, item in enumerate(matches) if item.get("plainLyric")]
+    if index is None:
+        index = with_lyrics[0] if with_lyrics else None
+    if index is None or not 0 <= index < len(matches) or not matches[index].get("plainLyric"):
+        return None
+    lyrics_data = to_lyrics(matches[index], query)
+    db_manager.save_lyrics(query, lyrics_data)
+    lyrics_data["matches"] = [
+        {"index": i, "title": item.get("songTitle", ""), "artist": item.get("artistName", ""), "has_lyrics": i in with_lyrics}
+        for i, item in enumerate(matches)
+    ]
+    lyrics_data["selected"] = index
+    return lyrics_data
+
+def search_simpmusic_only(query, search_type="song", index=None):
     """
     Dedicated function to search SimpMusic API.
+    index picks one of the returned matches; the search response is cached, so choosing
+    another match after the first lookup doesn't call the API again.
     """
-    base_url = "https://api-lyrics.simpmusic.org/v1/search"
-
-    if search_type == "artist":
-        url = f"{base_url}/artist"
-        params = {"artist": query}
-    elif search_type == "title" or search_type == "song":
-        url = f"{base_url}/title"
-        params = {"title": query}
-    else:
-        url = base_url
-        params = {"q": query}
+    miss_key = simpmusic_miss_key(query, search_type)
+    if db_manager.get_miss("simpmusic", miss_key):
+        return {"error": "No lyrics found via SimpMusic API."}
 
     try:
-        # Using requests params to handle encoding and query construction
-        r = requests.get(url, params=params, timeout=45)
-        r.raise_for_status()
-        data = r.json()
-        
-        if data.get("success") and data.get("data") and len(data["data"]) > 0:
-            first_result = data["data"][0]
-            lyrics_data = {
-                "title": first_result.get("songTitle", query),
-                "artist": first_result.get("artistName", "Unknown"),
-                "lyrics": first_result.get("plainLyric", ""),
-                "source": "SimpMusic API"
-            }
-            
-            if lyrics_data["lyrics"]:
-                db_manager.save_lyrics(query, lyrics_data)
-                return lyrics_data
+        matches = simpmusic.search(query, search_type)
+    except SimpMusicError as e:
+        return {"error": str(e)}
 
+    result = _simpmusic_result(query, search_type, matches, index)
+    if result is None:
+        if not any(item.get("plainLyric") for item in matches):
+            db_manager.record_miss("simpmusic", miss_key)
         return {"error": "No lyrics found via SimpMusic API."}
-    except requests.exceptions.RequestException as e:
-        if isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
-            if e.response.status_code == 429:
-                return {"error": "SimpMusic API Rate Limit Exceeded. Please try again later."}
-            if e.response.status_code == 503:
-                return {"error": "SimpMusic API Service Unavailable. Please try again later."}
-            if e.response.status_code == 404:
-                return {"error": "No lyrics found via SimpMusic API."}
-        return {"error": f"SimpMusic API Error: {str(e)}"}
\ No newline at end of file
+    return result
+
+def search_simpmusic_batch(queries, search_type="song", concurrency=None):
+    """
+    Looks up many titles (or artists) in one go, at most SIMPMUSIC_BATCH_CONCURRENCY requests at a time.
+    Returns one result per query, in order: lyrics with all matches, or {"query", "error"}.
+    """
+    concurrency = SIMPMUSIC_BATCH_CONCURRENCY if concurrency is None else concurrency
+    results = {}
+    pending = []
+    for query in dict.fromkeys(queries):
+        if db_manager.get_miss("simpmusic", simpmusic_miss_key(query, search_type)):
+            results[query] = {"query": query, "error": "No lyrics found via SimpMusic API."}
+        else:
+            pending.append((query, search_type))
+
+    for (query, _), found in simpmusic.search_many(pending, concurrency).items():
+        if "error" in found:
+            results[query] = {"query": query, "error": found["error"]}
+            continue
+        result = _simpmusic_result(query, search_type, found["matches"])
+        if result is None:
+            db_manager.record_miss("simpmusic", simpmusic_miss_key(query, search_type))
+            result = {"query": query, "error": "No lyrics found via SimpMusic API."}
+        results[query] = {"query": query, **result}
+    return [results[query] for query in queries]
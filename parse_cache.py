@@ -0,0 +1,86 @@
+import copy
+import gzip
+import json
+import time
+import hashlib
+from typing import Any, Callable, Optional
+
+from cache_engine import MemoryCache
+
+KEY_PREFIX = "parsed:"
+
+
+def content_hash(html: str) -> str:
+    return hashlib.sha256(html.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def fingerprint(*parts: Any) -> str:
+    """Short stable digest of JSON-able parts, for versions that depend on configuration (e.g. selectors)."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:10]
+
+
+class ParseCache:
+    """
+    Extractor outputs keyed by (content hash, extractor name, extractor version).
+
+    The same page is never parsed twice by the same extractor, whichever URL or cache tier
+    it came from. Bumping an extractor's version changes every key, so results are re-derived
+    from the cached HTML the next time a page is read, and nothing has to be fetched again.
+    Results are kept in Redis (shared by all workers) with a per-process tier in front; None
+    is a result too ("no lyrics container on this page") and is cached like any other.
+    """
+
+    def __init__(self, redis_client=None, ttl: int = 7 * 86400, memory_bytes: int = 16 * 1024 * 1024):
+        self.redis = redis_client
+        self.ttl = ttl
+        self._local = MemoryCache(memory_bytes, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(html: str, extractor: str, version: str) -> str:
+        return f"{KEY_PREFIX}{extractor}:{version}:{content_hash(html)}"
+
+    def get_or_parse(self, html: str, extractor: str, version: str, parse: Callable[[str], Any]) -> Any:
+        """parse(html), or the result an extractor of the same name and version produced for identical html."""
+        key = self.key(html, extractor, version)
+        found, value = self._get(key)
+        if found:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = parse(html)
+        self._set(key, value)
+        return value
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "memory": self._local.stats()}
+
+    def _get(self, key: str):
+        wrapped: Optional[dict] = self._local.get(key)
+        if wrapped is None and self.redis is not None:
+            try:
+                raw = self.redis.get(key)
+                if raw:
+                    wrapped = json.loads(gzip.decompress(raw))
+                    self._local.set(key, wrapped, time.time())
+            except Exception as e:
+                print(f"Parse cache unavailable: {e}")
+        if wrapped is None:
+            return False, None
+        # Callers own what they get back (scrapers add fields to it), so the cached copy stays pristine
+        return True, copy.deepcopy(wrapped["value"])
+
+    def _set(self, key: str, value: Any) -> None:
+        # Wrapped, so a cached None is told apart from a miss
+        try:
+            encoded = json.dumps({"value": value})
+        except (TypeError, ValueError) as e:
+            print(f"Not caching unserializable parse result for {key}: {e}")
+            return
+        self._local.set(key, json.loads(encoded), time.time())
+        if self.redis is not None:
+            try:
+                self.redis.set(key, gzip.compress(encoded.encode("utf-8")), ex=self.ttl)
+            except Exception as e:
+                print(f"Could not cache parse result: {e}")
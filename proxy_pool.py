@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import random
+import threading
+from typing import Dict, List, Optional
+import requests
+
+# Latency assumed for proxies we haven't measured yet, in seconds
+DEFAULT_LATENCY = 5.0
+# Weight of the newest sample in the moving latency average
+LATENCY_ALPHA = 0.3
+# How long a process trusts its copy of the shared health data before re-reading it from Redis
+HEALTH_REFRESH_SECONDS = 5
+# Health of proxies nobody has used for this long is forgotten
+HEALTH_KEY_TTL = 7 * 24 * 3600
+HEALTH_KEY_PREFIX = "proxy_health:"
+
+# Atomically applies one outcome to a proxy's health hash so concurrent workers don't lose updates.
+# KEYS[1] = health hash; ARGV = ok, latency ("" if unknown), now, base_backoff, max_backoff, alpha, key_ttl
+_REPORT_SCRIPT = """
+local key = KEYS[1]
+if ARGV[1] == "1" then
+    redis.call("HINCRBY", key, "successes", 1)
+    redis.call("HSET", key, "consecutive_failures", 0, "quarantined_until", 0)
+    if ARGV[2] ~= "" then
+        local sample = tonumber(ARGV[2])
+        local current = tonumber(redis.call("HGET", key, "latency"))
+        if current then
+            local alpha = tonumber(ARGV[6])
+            sample = alpha * sample + (1 - alpha) * current
+        end
+        redis.call("HSET", key, "latency", tostring(sample))
+    end
+else
+    redis.call("HINCRBY", key, "failures", 1)
+    local streak = redis.call("HINCRBY", key, "consecutive_failures", 1)
+    local backoff = math.min(tonumber(ARGV[5]), tonumber(ARGV[4]) * 2 ^ (streak - 1))
+    redis.call("HSET", key, "quarantined_until", tostring(tonumber(ARGV[3]) + backoff))
+end
+redis.call("EXPIRE", key, tonumber(ARGV[7]))
+"""
+
+
+def is_proxy_error(exc: Exception) -> bool:
+    """True for errors a proxy can cause (refused, reset, tunnel/TLS failure, timeout), not HTTP status errors."""
+    return isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+class _ProxyStats:
+    __slots__ = ("successes", "failures", "latency", "consecutive_failures", "quarantined_until", "anonymity")
+
+    def __init__(self, latency: Optional[float] = None, anonymity: str = "unknown"):
+        self.successes = 0
+        self.failures = 0
+        self.latency = latency
+        self.consecutive_failures = 0
+        self.quarantined_until = 0.0
+        self.anonymity = anonymity
+
+    def success_rate(self) -> float:
+        # Laplace prior so new proxies start at 0.5 rather than 0 or 1
+        return (self.successes + 1) / (self.successes + self.failures + 2)
+
+    def score(self) -> float:
+        score = self.success_rate() / (self.latency or DEFAULT_LATENCY)
+        # Transparent proxies leak our address to the target, which makes blocks more likely
+        return score / 2 if self.anonymity == "transparent" else score
+
+    def apply(self, ok: bool, latency: Optional[float], base_backoff: float, max_backoff: float) -> None:
+        if ok:
+            self.successes += 1
+            self.consecutive_failures = 0
+            self.quarantined_until = 0.0
+            if latency is not None:
+                if self.latency is None:
+                    self.latency = latency
+                else:
+                    self.latency = LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * self.latency
+        else:
+            self.failures += 1
+            self.consecutive_failures += 1
+            backoff = min(max_backoff, base_backoff * 2 ** (self.consecutive_failures - 1))
+            self.quarantined_until = time.time() + backoff
+
+
+class ProxyPool:
+    """
+    Health-scored pool over the proxies listed in proxies.txt.
+
+    The file is read once and re-read only when its mtime changes, together
+    with the validator's metadata file (proxies.json), whose probe latency and
+    anonymity seed proxies that have no live history yet. Call load()
+    in the RQ worker parent so forked job processes inherit the parsed list.
+    Callers report the outcome of each request made through a proxy; healthy,
+    fast proxies are picked more often and failing ones are quarantined with
+    exponential backoff. When a Redis client is available the health data is
+    kept there, so it survives job processes and is shared by all workers.
+    """
+
+    def __init__(self, path: str = "proxies.txt", base_backoff: float = 30, max_backoff: float = 1800,
+                 redis_client=None, metadata_path: Optional[str] = "proxies.json"):
+        self.path = path
+        self.metadata_path = metadata_path
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.redis = redis_client
+
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._proxies: List[str] = []
+        self._stats: Dict[str, _ProxyStats] = {}
+        self._warned_missing = False
+        self._health_loaded_at = 0.0
+        self._report_script = None
+
+    def load(self) -> None:
+        """Reads the proxy list (if changed) and the shared health data now rather than on first use."""
+        with self._lock:
+            self._reload_if_changed()
+            self._refresh_health(force=True)
+
+    def _reload_if_changed(self) -> None:
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            if not self._warned_missing:
+                print(f"{self.path} not found. Continuing without proxy.")
+                self._warned_missing = True
+            self._proxies = []
+            self._mtime = None
+            return
+        if mtime == self._mtime:
+            return
+
+        with open(self.path, "r") as f:
+            proxies = [line.strip() for line in f if line.strip()]
+        metadata = self._read_metadata()
+        self._proxies = proxies
+        stats = {}
+        for p in proxies:
+            # Keep health data for proxies that survived the refresh; seed new ones from the last validation
+            meta = metadata.get(p, {})
+            stats[p] = self._stats.get(p) or _ProxyStats(meta.get("latency"), meta.get("anonymity") or "unknown")
+        self._stats = stats
+        self._mtime = mtime
+        self._warned_missing = False
+        self._health_loaded_at = 0.0
+
+    def _read_metadata(self) -> Dict[str, Dict]:
+        if not self.metadata_path:
+            return {}
+        try:
+            with open(self.metadata_path, "r", encoding="utf-8") as f:
+                entries = json.load(f).get("proxies", [])
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"Ignoring unreadable proxy metadata {self.metadata_path}: {e}")
+            return {}
+        return {e["proxy"]: e for e in entries if isinstance(e, dict) and e.get("proxy")}
+
+    def _refresh_health(self, force: bool = False) -> None:
+        if self.redis is None or not self._proxies:
+            return
+        if not force and time.time() - self._health_loaded_at < HEALTH_REFRESH_SECONDS:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for p in self._proxies:
+                pipe.hgetall(HEALTH_KEY_PREFIX + p)
+            rows = pipe.execute()
+        except Exception as e:
+            print(f"Could not read proxy health from Redis: {e}")
+            self._health_loaded_at = time.time()
+            return
+        for p, row in zip(self._proxies, rows):
+            if not row:
+                continue
+            row = {k.decode() if isinstance(k, bytes) else k: float(v) for k, v in row.items()}
+            stats = self._stats[p]
+            stats.successes = int(row.get("successes", 0))
+            stats.failures = int(row.get("failures", 0))
+            stats.consecutive_failures = int(row.get("consecutive_failures", 0))
+            stats.quarantined_until = row.get("quarantined_until", 0.0)
+            if "latency" in row:
+                stats.latency = row["latency"]
+        self._health_loaded_at = time.time()
+
+    def acquire(self) -> Optional[str]:
+        """Returns a proxy (host:port) weighted towards fast, reliable ones, or None if none are usable."""
+        with self._lock:
+            self._reload_if_changed()
+            self._refresh_health()
+            now = time.time()
+            candidates = [p for p in self._proxies if self._stats[p].quarantined_until <= now]
+            if not candidates:
+                return None
+            # Weighted rather than greedy so one fast proxy doesn't absorb all traffic and get banned
+            weights = [self._stats[p].score() for p in candidates]
+            return random.choices(candidates, weights=weights, k=1)[0]
+
+    def report(self, proxy: Optional[str], ok: bool, latency: Optional[float] = None) -> None:
+        """
+        Records the outcome of one request made through proxy. Report at most once per attempt,
+        only failures the proxy can cause (see is_proxy_error), and latency from direct requests only.
+        """
+        if not proxy:
+            return
+        with self._lock:
+            stats = self._stats.get(proxy)
+            if stats is None:
+                return
+            stats.apply(ok, latency, self.base_backoff, self.max_backoff)
+
+        if self.redis is None:
+            return
+        try:
+            if self._report_script is None:
+                self._report_script = self.redis.register_script(_REPORT_SCRIPT)
+            self._report_script(
+                keys=[HEALTH_KEY_PREFIX + proxy],
+                args=["1" if ok else "0", "" if latency is None else f"{latency:.4f}", f"{time.time():.3f}",
+                      self.base_backoff, self.max_backoff, LATENCY_ALPHA, HEALTH_KEY_TTL],
+            )
+        except Exception as e:
+            print(f"Could not record proxy health in Redis: {e}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            now = time.time()
+            return {
+                "total": len(self._proxies),
+                "quarantined": sum(1 for p in self._proxies if self._stats[p].quarantined_until > now),
+                "measured": sum(1 for p in self._proxies if self._stats[p].latency is not None),
+                "shared": self.redis is not None,
+            }
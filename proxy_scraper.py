@@ -1,32 +1,170 @@
+import os
+import json
+import time
 import requests
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, wait
 from common import fetch_with_flaresolverr
+from html_parsing import parse_html
 
-def scrape_and_save_proxies(url="https://free-proxy-list.net/en/"):
+PROXY_FILE = "proxies.txt"
+PROXY_TABLE_SELECTOR = "table.table.table-striped.table-bordered"
+PROXY_METADATA_FILE = "proxies.json"  # Latency/anonymity per live proxy; seeds the fetch layer's ProxyPool
+
+# Anonymity is graded against a plain-HTTP echo endpoint: over https:// the proxy only tunnels (CONNECT)
+# and can't add Via/X-Forwarded-For, so every proxy would look "elite"
+PROXY_CHECK_URL = os.environ.get("PROXY_CHECK_URL", "http://httpbin.org/get")
+# Second probe through CONNECT to record whether the proxy can carry HTTPS traffic; empty disables it
+PROXY_HTTPS_CHECK_URL = os.environ.get("PROXY_HTTPS_CHECK_URL", "https://httpbin.org/ip")
+# Where to learn our own public address (JSON {"origin": ip} or plain text), or set PROXY_REAL_IP directly
+PROXY_IP_ECHO_URL = os.environ.get("PROXY_IP_ECHO_URL", "http://httpbin.org/ip")
+PROXY_REAL_IP = os.environ.get("PROXY_REAL_IP")
+PROXY_CHECK_TIMEOUT = float(os.environ.get("PROXY_CHECK_TIMEOUT", 8))  # hard deadline per probe, seconds
+PROXY_CHECK_CONCURRENCY = int(os.environ.get("PROXY_CHECK_CONCURRENCY", 200))
+
+# Headers a proxy adds when it reveals that a proxy is in use
+PROXY_REVEALING_HEADERS = {"via", "x-forwarded-for", "forwarded", "x-real-ip", "proxy-connection", "x-proxy-id"}
+
+
+def _public_ip():
+    """Our own address, used to spot transparent proxies. None if it can't be determined."""
+    if PROXY_REAL_IP:
+        return PROXY_REAL_IP
+    if not PROXY_IP_ECHO_URL:
+        return None
+    try:
+        r = requests.get(PROXY_IP_ECHO_URL, timeout=5)
+        r.raise_for_status()
+        try:
+            return str(r.json().get("origin", "")).split(",")[0].strip() or None
+        except ValueError:
+            return r.text.strip() or None
+    except requests.exceptions.RequestException as e:
+        print(f"Could not determine public IP from {PROXY_IP_ECHO_URL}: {e}")
+        return None
+
+
+def _grade_anonymity(response, real_ip):
+    try:
+        body = response.json()
+    except ValueError:
+        return "unknown"  # Custom target that doesn't echo the request
+    origin = str(body.get("origin", ""))
+    headers = {k.lower(): str(v) for k, v in (body.get("headers") or {}).items()}
+    if not real_ip:
+        # Without our own address a transparent proxy is indistinguishable from an anonymous one
+        return "unknown"
+    if real_ip in origin or any(real_ip in v for v in headers.values()):
+        return "transparent"
+    if PROXY_REVEALING_HEADERS & headers.keys():
+        return "anonymous"
+    return "elite"
+
+
+def check_proxy(proxy, target=PROXY_CHECK_URL, timeout=PROXY_CHECK_TIMEOUT, real_ip=None,
+                https_target=PROXY_HTTPS_CHECK_URL):
     """
-    Scrapes proxy list from a given URL and saves them to proxies.txt.
+    Probes a single host:port proxy. Returns {"proxy", "latency", "anonymity", "https_ok"} if it
+    answered the main probe with a 200 inside the deadline, otherwise None. The optional HTTPS
+    probe only gets whatever is left of the same deadline.
+    """
+    proxies = {"http": f"http://{proxy}", "https": f"http://{proxy}"}
+    started = time.monotonic()
+    try:
+        r = requests.get(target, proxies=proxies, timeout=(timeout, timeout))
+        latency = time.monotonic() - started
+        if r.status_code != 200 or latency > timeout:
+            return None
+    except requests.exceptions.RequestException:
+        return None
+    result = {"proxy": proxy, "latency": round(latency, 3), "anonymity": _grade_anonymity(r, real_ip), "https_ok": None}
+
+    remaining = timeout - (time.monotonic() - started)
+    if https_target and remaining > 0.5:
+        try:
+            result["https_ok"] = requests.get(https_target, proxies=proxies, timeout=(remaining, remaining)).status_code == 200
+        except requests.exceptions.RequestException:
+            result["https_ok"] = False
+    return result
+
+
+def validate_proxies(proxies, target=PROXY_CHECK_URL, timeout=PROXY_CHECK_TIMEOUT, concurrency=PROXY_CHECK_CONCURRENCY):
+    """
+    Probes all proxies concurrently and returns the live ones sorted fastest first.
+    Probes still running when the deadline passes are abandoned and counted as dead.
+    """
+    if not proxies:
+        return []
+    real_ip = _public_ip()
+    executor = ThreadPoolExecutor(max_workers=min(concurrency, len(proxies)))
+    try:
+        futures = [executor.submit(check_proxy, p, target, timeout, real_ip) for p in proxies]
+        # Probes queued behind the concurrency limit get their own full deadline
+        batches = -(-len(proxies) // concurrency)
+        done, _ = wait(futures, timeout=timeout * batches + 2)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    live = [f.result() for f in done if f.result()]
+    live.sort(key=lambda p: p["latency"])
+    return live
+
+
+def _write_atomic(path, text):
+    # ProxyPool may re-read the file at any moment, so never expose a half-written list
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def scrape_and_save_proxies(url="https://free-proxy-list.net/en/", validate=True):
+    """
+    Scrapes proxy list from a given URL, keeps only the proxies that pass a live probe
+    (fastest first) and saves them to proxies.txt, with per-proxy metadata in proxies.json.
     """
     print(f"Fetching proxies from: {url}")
     try:
-        count = 0
-        html_content, _ = fetch_with_flaresolverr(url)
+        html_content, _ = fetch_with_flaresolverr(url, source="proxies", until=[PROXY_TABLE_SELECTOR])
         if not html_content:
             return {"error": "Failed to fetch proxy page content via FlareSolverr."}
 
-        soup = BeautifulSoup(html_content, "html.parser")
+        soup = parse_html(html_content, only=[PROXY_TABLE_SELECTOR])
         table = soup.find("table", class_="table table-striped table-bordered")
         if not table or not table.tbody:
             print("Could not find proxy table on the page.")
             return {"error": "Could not find proxy table on the page."}
 
-        with open("proxies.txt", "w", encoding="utf-8") as f:
-            for row in table.tbody.find_all("tr"):
-                cols = row.find_all("td")
-                if len(cols) > 1:
-                    f.write(f"{cols[0].text.strip()}:{cols[1].text.strip()}\n")
-                    count += 1
-        print(f"{count} proxies saved to proxies.txt")
-        return {"message": f"Successfully saved {count} proxies to proxies.txt."}
+        # Columns: IP, Port, Code, Country, Anonymity, Google, Https, Last Checked
+        listed = {}
+        for row in table.tbody.find_all("tr"):
+            cols = [c.text.strip() for c in row.find_all("td")]
+            if len(cols) > 1:
+                listed[f"{cols[0]}:{cols[1]}"] = {
+                    "country": cols[2] if len(cols) > 2 else "",
+                    "https": cols[6].lower() == "yes" if len(cols) > 6 else None,
+                }
+        print(f"{len(listed)} proxies found on the page")
+
+        if validate:
+            started = time.monotonic()
+            live = validate_proxies(list(listed))
+            print(f"{len(live)}/{len(listed)} proxies passed validation in {time.monotonic() - started:.1f}s")
+            if not live:
+                # Keep the previous list rather than leaving the fetch layer with nothing
+                return {"error": f"None of the {len(listed)} scraped proxies passed validation; proxies.txt left unchanged."}
+        else:
+            live = [{"proxy": p, "latency": None, "anonymity": "unknown", "https_ok": None} for p in listed]
+
+        for entry in live:
+            entry.update(listed[entry["proxy"]])
+
+        metadata = {"checked_at": time.time(), "target": PROXY_CHECK_URL if validate else None, "proxies": live}
+        _write_atomic(PROXY_METADATA_FILE, json.dumps(metadata, indent=2))
+        _write_atomic(PROXY_FILE, "".join(f"{entry['proxy']}\n" for entry in live))
+
+        count = len(live)
+        print(f"{count} proxies saved to {PROXY_FILE}")
+        return {"message": f"Successfully saved {count} working proxies to {PROXY_FILE} (out of {len(listed)} scraped)."}
     except requests.exceptions.RequestException as e:
         print(f"Error fetching proxies: {e}")
-        return {"error": f"An error occurred while fetching proxies: {e}"}
\ No newline at end of file
+        return {"error": f"An error occurred while fetching proxies: {e}"}
@@ -0,0 +1,147 @@
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+# Words people add to a song search that don't identify the song
+NOISE_WORDS = {
+    "lyrics", "lyric", "lyrical", "song", "songs", "official", "video", "audio", "hd", "hq",
+    "full", "with", "letra", "letras", "paroles",
+}
+PLACEHOLDERS = {"unknown title", "unknown artist", "unknown"}
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+_APOSTROPHES = re.compile(r"['’`]")
+
+
+def normalize_query(text: str) -> str:
+    """
+    Canonical form of a lyrics query or title: lowercase, diacritics and punctuation removed,
+    noise words ("lyrics", "official video", ...) dropped and whitespace collapsed.
+    "Amazing  Grace (Lyrics)" and "amazing grace" both become "amazing grace".
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    text = _APOSTROPHES.sub("", text)  # "don't" -> "dont", not "don t"
+    words = _PUNCTUATION.sub(" ", text).replace("_", " ").split()
+    kept = [w for w in words if w not in NOISE_WORDS]
+    # A query made only of noise words ("song") is still a query
+    return " ".join(kept or words)
+
+
+def trigrams(text: str) -> Set[str]:
+    """Word trigrams of an already normalized string, padded like pg_trgm ("  w", " wo", "wor", ...)."""
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    """True if a and b differ by at most one inserted, deleted or substituted character."""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    for i, (x, y) in enumerate(zip(a, b)):
+        if x != y:
+            return a[i + 1:] == b[i + 1:] if len(a) == len(b) else a[i:] == b[i + 1:]
+    return True
+
+
+def tokens_agree(query: str, candidate: str, typo_min_length: int = 5) -> bool:
+    """
+    True if two normalized strings name the same words, in any order: as many words each, every
+    query word matching a distinct candidate word exactly or, for words of typo_min_length or
+    more, within one edit. "amazng grace" agrees with "amazing grace"; "love me" doesn't agree
+    with "love me do", nor "someone like you" with "someone like me".
+    """
+    query_words, candidate_words = query.split(), candidate.split()
+    if len(query_words) != len(candidate_words):
+        return False
+    remaining = list(candidate_words)
+    # Exact words first, so a typo can't claim a word another query word matches exactly
+    typos = []
+    for word in query_words:
+        if word in remaining:
+            remaining.remove(word)
+        else:
+            typos.append(word)
+    for word in typos:
+        match = next((c for c in remaining if len(word) >= typo_min_length and _within_one_edit(word, c)), None)
+        if match is None:
+            return False
+        remaining.remove(match)
+    return True
+
+
+class QueryIndex:
+    """
+    In-memory trigram index from normalized strings (queries, "title artist") to lyrics keys.
+
+    best_match() scores candidates sharing a trigram with the query by Dice similarity and
+    returns the key of the best one above the threshold whose words agree with the query's
+    (see tokens_agree), so reordered or misspelt queries can reuse a stored document instead
+    of triggering a scrape, while a query for a different song sharing most of its letters can't.
+    """
+
+    def __init__(self, min_length: int = 4):
+        self.min_length = min_length
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str], Set[str]] = {}  # (key, text) -> trigrams
+        self._postings: Dict[str, Set[Tuple[str, str]]] = defaultdict(set)
+        self._by_key: Dict[str, Set[Tuple[str, str]]] = defaultdict(set)
+
+    def add(self, key: str, query: str, title: Optional[str] = None, artist: Optional[str] = None) -> None:
+        texts = {normalize_query(query)}
+        title = normalize_query(title) if title and title.lower() not in PLACEHOLDERS else ""
+        artist = normalize_query(artist) if artist and artist.lower() not in PLACEHOLDERS else ""
+        if title:
+            texts.update({title, f"{title} {artist}".strip(), f"{artist} {title}".strip()})
+        with self._lock:
+            for text in texts:
+                if len(text) < self.min_length or (key, text) in self._entries:
+                    continue
+                grams = trigrams(text)
+                self._entries[(key, text)] = grams
+                self._by_key[key].add((key, text))
+                for gram in grams:
+                    self._postings[gram].add((key, text))
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            for entry in self._by_key.pop(key, ()):
+                for gram in self._entries.pop(entry, ()):
+                    self._postings[gram].discard(entry)
+                    if not self._postings[gram]:
+                        del self._postings[gram]
+
+    def best_match(self, query: str, threshold: float = 0.85) -> Optional[str]:
+        text = normalize_query(query)
+        if len(text) < self.min_length:
+            return None  # Too short to tell "hello" from "hell"
+        grams = trigrams(text)
+        with self._lock:
+            shared: Dict[Tuple[str, str], int] = defaultdict(int)
+            for gram in grams:
+                for entry in self._postings.get(gram, ()):
+                    shared[entry] += 1
+            scored = []
+            for entry, common in shared.items():
+                score = 2 * common / (len(grams) + len(self._entries[entry]))
+                if score >= threshold:
+                    scored.append((score, entry))
+        for score, (key, candidate) in sorted(scored, reverse=True):
+            if tokens_agree(text, candidate):
+                return key
+        return None
+
+    def __len__(self) -> int:
+        return len(self._by_key)
+
+    def keys(self) -> Iterable[str]:
+        return list(self._by_key)
@@ -0,0 +1,195 @@
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+KEY_PREFIX = "ratelimit:"
+
+# Token bucket. KEYS[1] = bucket hash; ARGV = rate (tokens/s), burst, now (s).
+# Takes a token and returns 0, or returns the milliseconds to wait for the next one.
+_TAKE_TOKEN_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local tokens = tonumber(redis.call("HGET", KEYS[1], "tokens") or burst)
+local ts = tonumber(redis.call("HGET", KEYS[1], "ts") or now)
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) / rate * 1000)
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "ts", tostring(now))
+redis.call("EXPIRE", KEYS[1], 3600)
+return wait
+"""
+
+# Concurrency slot. KEYS[1] = in-flight zset, KEYS[2] = limit key; ARGV = member, now, lease expiry, initial limit.
+# Expired leases (crashed holders) are dropped first. Returns 1 if a slot was taken.
+_TAKE_SLOT_SCRIPT = """
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", ARGV[2])
+local limit = tonumber(redis.call("GET", KEYS[2]) or ARGV[4])
+if redis.call("ZCARD", KEYS[1]) < math.floor(limit) then
+    redis.call("ZADD", KEYS[1], ARGV[3], ARGV[1])
+    redis.call("EXPIRE", KEYS[1], 3600)
+    return 1
+end
+return 0
+"""
+
+# AIMD. KEYS[1] = limit key; ARGV = outcome ("up"/"down"), initial, min, max.
+_ADJUST_SCRIPT = """
+local limit = tonumber(redis.call("GET", KEYS[1]) or ARGV[2])
+if ARGV[1] == "down" then
+    limit = math.max(tonumber(ARGV[3]), limit / 2)
+else
+    limit = math.min(tonumber(ARGV[4]), limit + 1 / limit)
+end
+redis.call("SET", KEYS[1], tostring(limit), "EX", 86400)
+return tostring(limit)
+"""
+
+
+class RateLimitTimeout(Exception):
+    """No token or concurrency slot for the host became available in time."""
+
+
+class HostRateLimiter:
+    """
+    Per-host throttle shared by all worker processes through Redis.
+
+    Each request needs a token from the host's bucket (rate per second, up to burst) and one of
+    the host's concurrency slots. The concurrency limit adapts AIMD-style: it halves when the
+    host answers 429/503 and grows by 1/limit on every success. Without Redis the same
+    limits apply per process.
+    """
+
+    def __init__(self, redis_client=None, rate: float = 1.0, burst: int = 5, initial_concurrency: int = 4,
+                 min_concurrency: int = 1, max_concurrency: int = 8, lease_seconds: float = 180,
+                 overrides: Optional[Dict[str, Dict]] = None):
+        self.redis = redis_client
+        self.rate = rate
+        self.burst = burst
+        self.initial_concurrency = initial_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.lease_seconds = lease_seconds
+        self.overrides = overrides or {}  # host -> {"rate": ..., "burst": ...}
+
+        self._scripts = {}
+        self._lock = threading.Condition()
+        self._local_buckets: Dict[str, list] = {}
+        self._local_inflight: Dict[str, int] = {}
+        self._local_limits: Dict[str, float] = {}
+
+    def _script(self, name: str, source: str):
+        if name not in self._scripts:
+            self._scripts[name] = self.redis.register_script(source)
+        return self._scripts[name]
+
+    def _host_rate(self, host: str):
+        override = self.overrides.get(host, {})
+        return float(override.get("rate", self.rate)), float(override.get("burst", self.burst))
+
+    @contextmanager
+    def slot(self, host: str, timeout: float = 60):
+        """Blocks until host has a token and a free concurrency slot; raises RateLimitTimeout after timeout."""
+        deadline = time.monotonic() + timeout
+        member = self._acquire(host, deadline)
+        try:
+            yield
+        finally:
+            self._release(host, member)
+
+    def record(self, host: str, status_code: Optional[int]) -> None:
+        """Feeds a response status back into the host's concurrency limit."""
+        if status_code is None:
+            return
+        outcome = "down" if status_code in (429, 503) else "up"
+        if status_code >= 500 and outcome == "up":
+            return  # Other server errors say nothing about load on our side
+        if self.redis is not None:
+            try:
+                self._script("adjust", _ADJUST_SCRIPT)(
+                    keys=[KEY_PREFIX + "limit:" + host],
+                    args=[outcome, self.initial_concurrency, self.min_concurrency, self.max_concurrency])
+                return
+            except Exception as e:
+                print(f"Rate limiter could not update limit for {host}: {e}")
+        with self._lock:
+            limit = self._local_limits.get(host, float(self.initial_concurrency))
+            if outcome == "down":
+                limit = max(self.min_concurrency, limit / 2)
+            else:
+                limit = min(self.max_concurrency, limit + 1 / limit)
+            self._local_limits[host] = limit
+
+    # -- internals -----------------------------------------------------------
+
+    def _acquire(self, host: str, deadline: float) -> Optional[str]:
+        if self.redis is not None:
+            try:
+                return self._acquire_shared(host, deadline)
+            except RateLimitTimeout:
+                raise
+            except Exception as e:
+                print(f"Rate limiter unavailable for {host}, using local limits: {e}")
+        self._acquire_local(host, deadline)
+        return None
+
+    def _acquire_shared(self, host: str, deadline: float) -> str:
+        rate, burst = self._host_rate(host)
+        while True:
+            wait_ms = self._script("token", _TAKE_TOKEN_SCRIPT)(
+                keys=[KEY_PREFIX + "bucket:" + host], args=[rate, burst, f"{time.time():.3f}"])
+            if not wait_ms:
+                break
+            self._sleep_until(min(time.monotonic() + wait_ms / 1000, deadline), deadline, host)
+
+        member = uuid.uuid4().hex
+        while True:
+            now = time.time()
+            taken = self._script("slot", _TAKE_SLOT_SCRIPT)(
+                keys=[KEY_PREFIX + "inflight:" + host, KEY_PREFIX + "limit:" + host],
+                args=[member, f"{now:.3f}", f"{now + self.lease_seconds:.3f}", self.initial_concurrency])
+            if taken:
+                return member
+            self._sleep_until(min(time.monotonic() + 0.2, deadline), deadline, host)
+
+    def _acquire_local(self, host: str, deadline: float) -> None:
+        rate, burst = self._host_rate(host)
+        with self._lock:
+            while True:
+                tokens, ts = self._local_buckets.get(host, (burst, time.monotonic()))
+                now = time.monotonic()
+                tokens = min(burst, tokens + (now - ts) * rate)
+                limit = self._local_limits.get(host, float(self.initial_concurrency))
+                if tokens >= 1 and self._local_inflight.get(host, 0) < int(limit):
+                    self._local_buckets[host] = (tokens - 1, now)
+                    self._local_inflight[host] = self._local_inflight.get(host, 0) + 1
+                    return
+                self._local_buckets[host] = (tokens, now)
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise RateLimitTimeout(f"Rate limit for {host}: no slot within the deadline")
+                wait = (1 - tokens) / rate if tokens < 1 else remaining
+                self._lock.wait(min(wait, remaining, 1.0))
+
+    def _release(self, host: str, member: Optional[str]) -> None:
+        if member is not None:
+            try:
+                self.redis.zrem(KEY_PREFIX + "inflight:" + host, member)
+            except Exception:
+                pass  # The lease expires on its own
+            return
+        with self._lock:
+            self._local_inflight[host] = max(0, self._local_inflight.get(host, 0) - 1)
+            self._lock.notify_all()
+
+    @staticmethod
+    def _sleep_until(until: float, deadline: float, host: str) -> None:
+        if time.monotonic() >= deadline:
+            raise RateLimitTimeout(f"Rate limit for {host}: no slot within the deadline")
+        time.sleep(max(0.0, until - time.monotonic()))
@@ -0,0 +1,205 @@
+import gzip
+import json
+import time
+import random
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+
+from cache_engine import MemoryCache
+from rate_limiter import RateLimitTimeout
+
+CACHE_KEY_PREFIX = "simpmusic:cache:"
+COOLDOWN_KEY = "simpmusic:cooldown_until"  # set on 429 so every worker waits out Retry-After
+
+ENDPOINTS = {"artist": ("artist", "artist"), "title": ("title", "title"), "song": ("title", "title")}
+
+
+class SimpMusicError(Exception):
+    """The API could not be queried; status_code is the HTTP status if it answered, retry_after in seconds if known."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def _retry_after(response) -> Optional[float]:
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def to_lyrics(item: Dict, fallback_title: str = "") -> Dict:
+    """A SimpMusic search hit in the shape the rest of the app stores and renders."""
+    return {
+        "title": item.get("songTitle", fallback_title),
+        "artist": item.get("artistName", "Unknown"),
+        "lyrics": item.get("plainLyric", ""),
+        "source": "SimpMusic API",
+    }
+
+
+class SimpMusicClient:
+    """
+    Client for the SimpMusic lyrics API.
+
+    Responses are cached per (endpoint, params) in Redis (per process without it), so
+    repeated and follow-up lookups don't reach the API. Requests go through the shared
+    per-host rate limiter; a 429 is retried after Retry-After (or exponential backoff) with
+    jitter, and the Retry-After is shared through Redis so other workers hold off too.
+    """
+
+    def __init__(self, base_url: str, session_getter: Callable, rate_limiter=None, redis_client=None,
+                 cache_ttl: int = 3600, timeout: float = 45, max_retries: int = 3, base_backoff: float = 1.0,
+                 max_backoff: float = 60, deadline: float = 90):
+        self.base_url = base_url.rstrip("/")
+        self.host = urlsplit(self.base_url).netloc
+        self.session_getter = session_getter
+        self.rate_limiter = rate_limiter
+        self.redis = redis_client
+        self.cache_ttl = cache_ttl
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self._local_cache = MemoryCache(8 * 1024 * 1024, ttl=cache_ttl)
+
+    def search(self, query: str, search_type: str = "song") -> List[Dict]:
+        """All hits for query, best first as ranked by the API. Raises SimpMusicError."""
+        endpoint, param = ENDPOINTS.get(search_type, ("", "q"))
+        data = self._get(endpoint, {param: query})
+        if not data.get("success"):
+            return []
+        return [item for item in (data.get("data") or []) if isinstance(item, dict)]
+
+    def search_many(self, queries: Iterable[Tuple[str, str]], concurrency: int = 4) -> Dict[Tuple[str, str], Dict]:
+        """
+        Resolves many (query, search_type) pairs with at most `concurrency` requests in flight.
+        Returns {(query, search_type): {"matches": [...]}} or {"error": message, "status_code": ...}.
+        """
+        pairs = list(dict.fromkeys(queries))
+
+        def one(pair):
+            try:
+                return pair, {"matches": self.search(*pair)}
+            except SimpMusicError as e:
+                return pair, {"error": str(e), "status_code": e.status_code}
+
+        if not pairs:
+            return {}
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(pairs))), thread_name_prefix="simpmusic") as executor:
+            return dict(executor.map(one, pairs))
+
+    # -- HTTP ------------------------------------------------------------------
+
+    def _cache_key(self, endpoint: str, params: Dict) -> str:
+        raw = json.dumps([endpoint, sorted(params.items())], ensure_ascii=False)
+        return CACHE_KEY_PREFIX + hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _cached(self, key: str) -> Optional[Dict]:
+        if self.redis is not None:
+            try:
+                raw = self.redis.get(key)
+                return json.loads(gzip.decompress(raw)) if raw else None
+            except Exception as e:
+                print(f"SimpMusic cache unavailable: {e}")
+        return self._local_cache.get(key)
+
+    def _store(self, key: str, data: Dict) -> None:
+        self._local_cache.set(key, data, time.time())
+        if self.redis is not None:
+            try:
+                self.redis.set(key, gzip.compress(json.dumps(data).encode("utf-8")), ex=self.cache_ttl)
+            except Exception as e:
+                print(f"Could not cache SimpMusic response: {e}")
+
+    def _cooldown_remaining(self) -> float:
+        if self.redis is None:
+            return 0.0
+        try:
+            until = self.redis.get(COOLDOWN_KEY)
+            return max(0.0, float(until) - time.time()) if until else 0.0
+        except Exception:
+            return 0.0
+
+    def _set_cooldown(self, seconds: float) -> None:
+        if self.redis is None or seconds <= 0:
+            return
+        try:
+            self.redis.set(COOLDOWN_KEY, f"{time.time() + seconds:.3f}", px=int(seconds * 1000) + 1)
+        except Exception:
+            pass
+
+    def _get(self, endpoint: str, params: Dict) -> Dict:
+        key = self._cache_key(endpoint, params)
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+
+        url = f"{self.base_url}/{endpoint}" if endpoint else self.base_url
+        give_up_at = time.monotonic() + self.deadline
+        for attempt in range(self.max_retries + 1):
+            wait = self._cooldown_remaining()
+            if wait > give_up_at - time.monotonic():
+                raise SimpMusicError("SimpMusic API Rate Limit Exceeded. Please try again later.", 429, wait)
+            if wait:
+                time.sleep(wait + random.uniform(0, self.base_backoff))
+
+            remaining = give_up_at - time.monotonic()
+            try:
+                if self.rate_limiter is not None:
+                    with self.rate_limiter.slot(self.host, timeout=remaining):
+                        r = self.session_getter().get(url, params=params, timeout=min(self.timeout, remaining))
+                    self.rate_limiter.record(self.host, r.status_code)
+                else:
+                    r = self.session_getter().get(url, params=params, timeout=min(self.timeout, remaining))
+            except RateLimitTimeout:
+                raise SimpMusicError("SimpMusic API Rate Limit Exceeded. Please try again later.", 429)
+            except requests.exceptions.RequestException as e:
+                raise SimpMusicError(f"SimpMusic API Error: {e}")
+
+            if r.status_code == 404:
+                data = {"success": True, "data": []}
+                self._store(key, data)
+                return data
+            if r.status_code in (429, 503):
+                retry_after = _retry_after(r)
+                if r.status_code == 429 and retry_after:
+                    self._set_cooldown(retry_after)
+                if attempt == self.max_retries:
+                    break
+                # Full jitter on top of Retry-After so the workers that were told the same time don't all retry at once
+                delay = retry_after if retry_after is not None else min(self.max_backoff, self.base_backoff * 2 ** attempt)
+                delay += random.uniform(0, max(self.base_backoff, delay / 2))
+                if delay > give_up_at - time.monotonic():
+                    raise SimpMusicError(self._status_message(r.status_code), r.status_code, retry_after)
+                time.sleep(delay)
+                continue
+            try:
+                r.raise_for_status()
+                data = r.json()
+            except (requests.exceptions.HTTPError, ValueError) as e:
+                raise SimpMusicError(f"SimpMusic API Error: {e}", r.status_code)
+            self._store(key, data)
+            return data
+        raise SimpMusicError(self._status_message(r.status_code), r.status_code, _retry_after(r))
+
+    @staticmethod
+    def _status_message(status_code: int) -> str:
+        if status_code == 429:
+            return "SimpMusic API Rate Limit Exceeded. Please try again later."
+        return "SimpMusic API Service Unavailable. Please try again later."
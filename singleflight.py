@@ -0,0 +1,162 @@
+import gzip
+import json
+import time
+import uuid
+import hashlib
+import threading
+from typing import Any, Callable, Dict, Optional
+
+LEASE_KEY_PREFIX = "singleflight:lease:"
+RESULT_KEY_PREFIX = "singleflight:result:"
+
+# Deletes the lease only if we still own it, so a leader whose lease already expired can't
+# release the lease of the worker that took over
+_RELEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+# Extends the lease only while we still own it
+_RENEW_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class _Call:
+    __slots__ = ("done", "result")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one execution.
+
+    Threads in one process wait on the first caller's result directly. Across processes the
+    first caller takes a Redis lease on the key, runs the function and publishes the result
+    under a short-lived key; the others poll for that result (or for a value appearing in the
+    caller's own cache) instead of repeating the work. Leases expire, so a crashed leader only
+    delays the others until the lease runs out, after which one of them takes over.
+
+    The leader renews its lease every lease_seconds / 3 while fn runs, so a slow call never
+    loses the lease mid-flight; lease_seconds only bounds how long a crashed leader goes
+    unnoticed. Followers wait at most max_wait (the longest fn is expected to take) in total.
+    """
+
+    def __init__(self, redis_client=None, lease_seconds: float = 30, result_ttl: int = 60,
+                 poll_interval: float = 0.25, max_wait: float = 300):
+        self.redis = redis_client
+        self.lease_seconds = lease_seconds
+        self.max_wait = max_wait
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._release = None
+        self._renew = None
+
+    def do(self, key: str, fn: Callable[[], Any], peek: Optional[Callable[[], Any]] = None) -> Any:
+        """
+        Returns fn() for key, running it at most once at a time across threads and workers.
+        peek, if given, is checked while waiting and returns a usable result (e.g. a cache hit) or None.
+        The result must be JSON-serialisable to be shared across processes.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            return call.result
+
+        try:
+            call.result = self._do_shared(key, fn, peek)
+            return call.result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _do_shared(self, key: str, fn: Callable[[], Any], peek: Optional[Callable[[], Any]]) -> Any:
+        if self.redis is None:
+            return fn()
+
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        lease_key = LEASE_KEY_PREFIX + digest
+        result_key = RESULT_KEY_PREFIX + digest
+        token = uuid.uuid4().hex
+        give_up_at = time.monotonic() + self.max_wait + 10
+
+        while True:
+            try:
+                acquired = self.redis.set(lease_key, token, nx=True, px=int(self.lease_seconds * 1000))
+            except Exception as e:
+                print(f"Single-flight lease unavailable, fetching without coordination: {e}")
+                return fn()
+            if acquired:
+                return self._lead(fn, lease_key, result_key, token)
+
+            # Another worker is on it: wait for its result, a cache fill, or the lease to disappear
+            while time.monotonic() < give_up_at:
+                time.sleep(self.poll_interval)
+                shared = self._read_result(result_key)
+                if shared is not None:
+                    return shared["value"]
+                if peek is not None:
+                    peeked = peek()
+                    if peeked is not None:
+                        return peeked
+                try:
+                    if not self.redis.exists(lease_key):
+                        break  # Leader finished without publishing or died; try to take over
+                except Exception:
+                    return fn()
+            else:
+                print(f"Gave up waiting for another worker on {key}; fetching it ourselves")
+                return fn()
+
+    def _keep_lease(self, lease_key: str, token: str, stop: threading.Event) -> None:
+        while not stop.wait(self.lease_seconds / 3):
+            try:
+                if self._renew is None:
+                    self._renew = self.redis.register_script(_RENEW_SCRIPT)
+                if not self._renew(keys=[lease_key], args=[token, int(self.lease_seconds * 1000)]):
+                    return  # Lost it (Redis flushed, or we stalled past the lease); a follower may take over
+            except Exception as e:
+                print(f"Could not renew single-flight lease: {e}")
+
+    def _lead(self, fn: Callable[[], Any], lease_key: str, result_key: str, token: str) -> Any:
+        stop = threading.Event()
+        threading.Thread(target=self._keep_lease, args=(lease_key, token, stop), daemon=True).start()
+        try:
+            value = fn()
+            try:
+                payload = gzip.compress(json.dumps({"value": value}).encode("utf-8"))
+                self.redis.set(result_key, payload, ex=self.result_ttl)
+            except Exception as e:
+                print(f"Could not publish single-flight result: {e}")
+            return value
+        finally:
+            stop.set()
+            try:
+                if self._release is None:
+                    self._release = self.redis.register_script(_RELEASE_SCRIPT)
+                self._release(keys=[lease_key], args=[token])
+            except Exception:
+                pass  # The lease expires on its own
+
+    def _read_result(self, result_key: str) -> Optional[Dict]:
+        try:
+            raw = self.redis.get(result_key)
+            return json.loads(gzip.decompress(raw)) if raw else None
+        except Exception:
+            return None
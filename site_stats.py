@@ -0,0 +1,146 @@
+import time
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+SAMPLES_KEY_PREFIX = "site_stats:samples:"  # list of recent "outcome:latency" samples per site
+HEALTH_KEY_PREFIX = "site_stats:health:"  # hash: consecutive_errors, demoted_until
+KEY_TTL = 30 * 24 * 3600
+
+# Outcomes: "hit" (lyrics found), "miss" (site answered, no lyrics), "error" (site unreachable or
+# broken page), "abandoned" (still running when the search moved on; latency is a lower bound)
+OUTCOMES = ("hit", "miss", "error", "abandoned")
+
+# KEYS[1] = health hash; ARGV = is_error, now, demote_after, base_backoff, max_backoff, key_ttl
+_HEALTH_SCRIPT = """
+local key = KEYS[1]
+if ARGV[1] == "1" then
+    local streak = redis.call("HINCRBY", key, "consecutive_errors", 1)
+    local over = streak - tonumber(ARGV[3])
+    if over >= 0 then
+        local backoff = math.min(tonumber(ARGV[5]), tonumber(ARGV[4]) * 2 ^ over)
+        redis.call("HSET", key, "demoted_until", tostring(tonumber(ARGV[2]) + backoff))
+    end
+else
+    redis.call("HSET", key, "consecutive_errors", 0, "demoted_until", 0)
+end
+redis.call("EXPIRE", key, tonumber(ARGV[6]))
+"""
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class SiteStats:
+    """
+    Rolling per-site outcome and latency statistics for the lyrics sources.
+
+    The last `window` samples per site are kept in Redis (per process without Redis), so
+    every worker ranks sites on the same data. Sites are ranked by hit rate per second of
+    median latency; a site that errors `demote_after` times in a row is demoted with
+    exponential backoff and only queried again once that expires.
+    """
+
+    def __init__(self, redis_client=None, window: int = 200, demote_after: int = 3,
+                 base_backoff: float = 300, max_backoff: float = 6 * 3600, default_latency: float = 10.0):
+        self.redis = redis_client
+        self.window = window
+        self.demote_after = demote_after
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.default_latency = default_latency
+
+        self._lock = threading.Lock()
+        self._local_samples: Dict[str, deque] = {}
+        self._local_health: Dict[str, Dict[str, float]] = {}
+        self._health_script = None
+
+    def record(self, site: str, outcome: str, latency: float) -> None:
+        sample = f"{outcome}:{latency:.3f}"
+        is_error = outcome == "error"
+        if outcome != "abandoned":
+            self._record_health_local(site, is_error)
+        with self._lock:
+            self._local_samples.setdefault(site, deque(maxlen=self.window)).appendleft(sample)
+        if self.redis is None:
+            return
+        try:
+            if self._health_script is None:
+                self._health_script = self.redis.register_script(_HEALTH_SCRIPT)
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.lpush(SAMPLES_KEY_PREFIX + site, sample)
+            pipe.ltrim(SAMPLES_KEY_PREFIX + site, 0, self.window - 1)
+            pipe.expire(SAMPLES_KEY_PREFIX + site, KEY_TTL)
+            pipe.execute()
+            if outcome != "abandoned":
+                self._health_script(
+                    keys=[HEALTH_KEY_PREFIX + site],
+                    args=["1" if is_error else "0", f"{time.time():.3f}", self.demote_after,
+                          self.base_backoff, self.max_backoff, KEY_TTL])
+        except Exception as e:
+            print(f"Could not record stats for {site} in Redis: {e}")
+
+    def _record_health_local(self, site: str, is_error: bool) -> None:
+        with self._lock:
+            health = self._local_health.setdefault(site, {"consecutive_errors": 0, "demoted_until": 0.0})
+            if not is_error:
+                health.update(consecutive_errors=0, demoted_until=0.0)
+                return
+            health["consecutive_errors"] += 1
+            over = health["consecutive_errors"] - self.demote_after
+            if over >= 0:
+                health["demoted_until"] = time.time() + min(self.max_backoff, self.base_backoff * 2 ** over)
+
+    def summary(self, sites: Iterable[str]) -> Dict[str, Dict]:
+        """Per site: samples, hit_rate, error_rate, p50, p95 (seconds) and demoted_until."""
+        sites = list(sites)
+        raw = self._read(sites)
+        result = {}
+        for site in sites:
+            samples, health = raw[site]
+            outcomes = [s.split(":", 1) for s in samples]
+            answered = [o for o, _ in outcomes if o != "abandoned"]
+            latencies = [float(l) for o, l in outcomes if o in ("hit", "miss", "abandoned")]
+            result[site] = {
+                "samples": len(outcomes),
+                # Laplace prior so unknown sites start in the middle and still get tried
+                "hit_rate": (answered.count("hit") + 1) / (len(answered) + 2),
+                "error_rate": answered.count("error") / len(answered) if answered else 0.0,
+                "p50": _percentile(latencies, 0.5),
+                "p95": _percentile(latencies, 0.95),
+                "demoted_until": float(health.get("demoted_until", 0.0)),
+            }
+        return result
+
+    def rank(self, sites: Iterable[str]) -> List[str]:
+        """Sites best first, without the currently demoted ones (unless every site is demoted)."""
+        summary = self.summary(sites)
+        now = time.time()
+        score = lambda s: summary[s]["hit_rate"] / (summary[s]["p50"] or self.default_latency)
+        ranked = sorted(summary, key=score, reverse=True)
+        active = [s for s in ranked if summary[s]["demoted_until"] <= now]
+        return active or ranked
+
+    def _read(self, sites: List[str]) -> Dict[str, tuple]:
+        if self.redis is not None:
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                for site in sites:
+                    pipe.lrange(SAMPLES_KEY_PREFIX + site, 0, self.window - 1)
+                    pipe.hgetall(HEALTH_KEY_PREFIX + site)
+                rows = pipe.execute()
+                decode = lambda v: v.decode() if isinstance(v, bytes) else v
+                return {
+                    site: ([decode(s) for s in rows[2 * i]],
+                           {decode(k): decode(v) for k, v in rows[2 * i + 1].items()})
+                    for i, site in enumerate(sites)
+                }
+            except Exception as e:
+                print(f"Could not read site stats from Redis, using local stats: {e}")
+        with self._lock:
+            return {site: (list(self._local_samples.get(site, ())), dict(self._local_health.get(site, {})))
+                    for site in sites}
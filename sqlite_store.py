@@ -0,0 +1,276 @@
+import os
+import json
+import time
+import sqlite3
+import zlib
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lyrics (
+    query TEXT PRIMARY KEY,
+    title TEXT,
+    artist TEXT,
+    doc TEXT NOT NULL,
+    timestamp REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lyrics_timestamp ON lyrics (timestamp);
+
+CREATE TABLE IF NOT EXISTS articles (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    title TEXT,
+    doc TEXT NOT NULL,
+    timestamp REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS articles_timestamp ON articles (timestamp);
+
+CREATE TABLE IF NOT EXISTS misses (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    reason TEXT,
+    timestamp REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+CREATE INDEX IF NOT EXISTS misses_expires_at ON misses (expires_at);
+
+CREATE TABLE IF NOT EXISTS search_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    type TEXT,
+    query TEXT,
+    metadata TEXT NOT NULL DEFAULT '{}',
+    count INTEGER NOT NULL DEFAULT 1,
+    timestamp REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS search_history_timestamp ON search_history (timestamp DESC);
+CREATE INDEX IF NOT EXISTS search_history_type ON search_history (type, timestamp DESC);
+
+CREATE TABLE IF NOT EXISTS favorites (
+    item_id TEXT PRIMARY KEY,
+    type TEXT,
+    title TEXT,
+    metadata TEXT NOT NULL DEFAULT '{}',
+    timestamp REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS favorites_type ON favorites (type, timestamp DESC);
+"""
+
+
+def _ts(value) -> float:
+    return value.timestamp() if isinstance(value, datetime) else float(value)
+
+
+def _dt(value: float) -> datetime:
+    return datetime.fromtimestamp(value)
+
+
+def _dumps(doc) -> str:
+    return json.dumps(doc, ensure_ascii=False, default=str)
+
+
+class SQLiteStore:
+    """
+    Embedded storage for MongoDBManager when MongoDB isn't available.
+
+    One SQLite file in WAL mode, so every gunicorn and RQ process on the box reads what the
+    others wrote while a write is in progress. Lyrics and articles expire after ttl like
+    Mongo's TTL indexes: reads ignore expired rows and a purge deletes them at most once per
+    purge_interval. Documents are stored as JSON next to the columns they are looked up by,
+    and come back as dicts shaped like the Mongo documents (datetimes included, no _id).
+    """
+
+    def __init__(self, path: str, ttl: float, history_max_rows: int = 1000, purge_interval: float = 60,
+                 busy_timeout: float = 10, compress_min_bytes: int = 1024):
+        self.path = path
+        self.compress_min_bytes = compress_min_bytes
+        self.ttl = ttl
+        self.history_max_rows = history_max_rows
+        self.purge_interval = purge_interval
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._purged_at = 0.0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        """This thread's connection (SQLite connections can't cross threads or forks)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")  # Durable at checkpoints; fine for a cache
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _fresh_after(self) -> float:
+        return time.time() - self.ttl
+
+    def _maybe_purge(self, conn) -> None:
+        now = time.time()
+        if now - self._purged_at < self.purge_interval:
+            return
+        self._purged_at = now
+        conn.execute("DELETE FROM lyrics WHERE timestamp <= ?", (now - self.ttl,))
+        conn.execute("DELETE FROM articles WHERE timestamp <= ?", (now - self.ttl,))
+        conn.execute("DELETE FROM misses WHERE expires_at <= ?", (now,))
+
+    # -- lyrics ----------------------------------------------------------------
+
+    def _pack(self, doc: Dict):
+        """The doc column: JSON text, or zlib-compressed JSON (a BLOB) once it reaches compress_min_bytes."""
+        text = _dumps(doc)
+        if self.compress_min_bytes and len(text) >= self.compress_min_bytes:
+            return zlib.compress(text.encode("utf-8"))
+        return text
+
+    @staticmethod
+    def _doc(row) -> Dict:
+        raw = row["doc"]
+        if isinstance(raw, bytes):
+            raw = zlib.decompress(raw).decode("utf-8")
+        return {**json.loads(raw), "timestamp": _dt(row["timestamp"])}
+
+    def find_lyrics(self, key: str) -> Optional[Dict]:
+        row = self._conn().execute("SELECT doc, timestamp FROM lyrics WHERE query = ? AND timestamp > ?",
+                                   (key, self._fresh_after())).fetchone()
+        return self._doc(row) if row else None
+
+    def find_lyrics_titles(self, keys: List[str]) -> List[Dict]:
+        if not keys:
+            return []
+        marks = ",".join("?" * len(keys))
+        rows = self._conn().execute(f"SELECT query, title FROM lyrics WHERE query IN ({marks}) AND timestamp > ?",
+                                    (*keys, self._fresh_after())).fetchall()
+        return [dict(row) for row in rows]
+
+    def lyrics_since(self, since: Optional[datetime]) -> Iterable[Dict]:
+        """query/title/artist/timestamp of the lyrics saved after since (all of them if None)."""
+        after = max(_ts(since), self._fresh_after()) if since else self._fresh_after()
+        rows = self._conn().execute("SELECT query, title, artist, timestamp FROM lyrics WHERE timestamp > ?", (after,))
+        return [{**dict(row), "timestamp": _dt(row["timestamp"])} for row in rows]
+
+    def save_lyrics(self, key: str, doc: Dict) -> None:
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO lyrics (query, title, artist, doc, timestamp) VALUES (?, ?, ?, ?, ?)",
+                (key, doc.get("title"), doc.get("artist"), self._pack({**doc, "query": key}), time.time()),
+            )
+            self._maybe_purge(conn)
+
+    # -- articles --------------------------------------------------------------
+
+    def find_article(self, key: str, url: str) -> Optional[Dict]:
+        row = self._conn().execute("SELECT doc, timestamp FROM articles WHERE (key = ? OR url = ?) AND timestamp > ?",
+                                   (key, url, self._fresh_after())).fetchone()
+        return self._doc(row) if row else None
+
+    def find_article_titles(self, keys: List[str]) -> List[Dict]:
+        if not keys:
+            return []
+        marks = ",".join("?" * len(keys))
+        rows = self._conn().execute(f"SELECT key, url, title FROM articles WHERE key IN ({marks}) AND timestamp > ?",
+                                    (*keys, self._fresh_after())).fetchall()
+        return [dict(row) for row in rows]
+
+    def save_article(self, key: str, url: str, doc: Dict) -> None:
+        with self._conn() as conn:
+            # The first URL an article was stored under stays, as with the Mongo upsert
+            row = conn.execute("SELECT url FROM articles WHERE key = ?", (key,)).fetchone()
+            url = row["url"] if row else url
+            conn.execute(
+                "INSERT OR REPLACE INTO articles (key, url, title, doc, timestamp) VALUES (?, ?, ?, ?, ?)",
+                (key, url, doc.get("title"), self._pack({**doc, "key": key, "url": url}), time.time()),
+            )
+            self._maybe_purge(conn)
+
+    # -- negative cache --------------------------------------------------------
+
+    def find_miss(self, kind: str, key: str) -> Optional[Dict]:
+        row = self._conn().execute("SELECT * FROM misses WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+        if row is None:
+            return None
+        return {**dict(row), "timestamp": _dt(row["timestamp"]), "expires_at": _dt(row["expires_at"])}
+
+    def save_miss(self, miss: Dict) -> None:
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO misses (kind, key, reason, timestamp, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (miss["kind"], miss["key"], miss.get("reason"), _ts(miss["timestamp"]), _ts(miss["expires_at"])),
+            )
+            self._maybe_purge(conn)
+
+    def delete_miss(self, kind: str, key: str) -> None:
+        with self._conn() as conn:
+            conn.execute("DELETE FROM misses WHERE kind = ? AND key = ?", (kind, key))
+
+    # -- search history --------------------------------------------------------
+
+    @staticmethod
+    def _history_row(row) -> Dict:
+        return {"_id": row["id"], "type": row["type"], "query": row["query"], "metadata": json.loads(row["metadata"]),
+                "count": row["count"], "timestamp": _dt(row["timestamp"])}
+
+    def write_history(self, entries: List[Dict]) -> None:
+        """Inserts buffered entries in one transaction; a repeat of the newest row bumps its count instead."""
+        with self._conn() as conn:
+            latest = conn.execute("SELECT id, type, query, metadata FROM search_history "
+                                  "ORDER BY timestamp DESC, id DESC LIMIT 1").fetchone()
+            first = entries[0]
+            if latest and (latest["type"], latest["query"]) == (first["type"], first["query"]):
+                metadata = {**json.loads(latest["metadata"]), **first["metadata"]}
+                conn.execute("UPDATE search_history SET count = count + ?, timestamp = ?, metadata = ? WHERE id = ?",
+                             (first["count"], _ts(first["timestamp"]), _dumps(metadata), latest["id"]))
+                entries = entries[1:]
+            conn.executemany(
+                "INSERT INTO search_history (type, query, metadata, count, timestamp) VALUES (?, ?, ?, ?, ?)",
+                [(e["type"], e["query"], _dumps(e["metadata"]), e["count"], _ts(e["timestamp"])) for e in entries],
+            )
+            conn.execute("DELETE FROM search_history WHERE id NOT IN "
+                         "(SELECT id FROM search_history ORDER BY timestamp DESC, id DESC LIMIT ?)",
+                         (self.history_max_rows,))
+
+    def get_history(self, search_type: Optional[str] = None, limit: int = 20) -> List[Dict]:
+        if search_type:
+            rows = self._conn().execute("SELECT * FROM search_history WHERE type = ? ORDER BY timestamp DESC, id DESC LIMIT ?",
+                                        (search_type, limit))
+        else:
+            rows = self._conn().execute("SELECT * FROM search_history ORDER BY timestamp DESC, id DESC LIMIT ?", (limit,))
+        return [self._history_row(row) for row in rows]
+
+    def clear_history(self, search_type: Optional[str] = None) -> None:
+        with self._conn() as conn:
+            if search_type:
+                conn.execute("DELETE FROM search_history WHERE type = ?", (search_type,))
+            else:
+                conn.execute("DELETE FROM search_history")
+
+    # -- favorites -------------------------------------------------------------
+
+    def save_favorite(self, entry: Dict) -> None:
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO favorites (item_id, type, title, metadata, timestamp) VALUES (?, ?, ?, ?, ?)",
+                (entry["item_id"], entry["type"], entry["title"], _dumps(entry["metadata"]), _ts(entry["timestamp"])),
+            )
+
+    def delete_favorite(self, item_id: str) -> None:
+        with self._conn() as conn:
+            conn.execute("DELETE FROM favorites WHERE item_id = ?", (item_id,))
+
+    def get_favorites(self, item_type: Optional[str] = None, limit: int = 100) -> List[Dict]:
+        if item_type:
+            rows = self._conn().execute("SELECT * FROM favorites WHERE type = ? ORDER BY timestamp DESC LIMIT ?",
+                                        (item_type, limit))
+        else:
+            rows = self._conn().execute("SELECT * FROM favorites ORDER BY timestamp DESC LIMIT ?", (limit,))
+        return [{**dict(row), "metadata": json.loads(row["metadata"]), "timestamp": _dt(row["timestamp"])} for row in rows]
+
+    def is_favorite(self, item_id: str) -> bool:
+        # Answered from the primary key index alone
+        return self._conn().execute("SELECT 1 FROM favorites WHERE item_id = ?", (item_id,)).fetchone() is not None
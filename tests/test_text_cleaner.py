@@ -0,0 +1,68 @@
+import random
+import re
+
+import pytest
+
+from text_cleaner import _cut_prefix, cleaner_for
+
+
+def old_clean_recon_article(raw_text):
+    # medium_scraper.clean_recon_article before the rules moved to text_cleaner; the "medium"
+    # cleaner must give the same output for every input
+    text = re.sub(r'<[^>]+>', '', raw_text)
+    ui_elements = [
+        r"Sign up\s+Sign in",
+        r"Top highlight",
+        r"Listen\s+Share",
+        r"\d+\s+\d+\s+19",
+        r"Write a response.*",
+        r"Help\s+Status\s+About.*",
+        r"Jul \d+|Aug \d+",
+        r"Reply\s+\d+\s+reply"
+    ]
+    for pattern in ui_elements:
+        text = re.sub(pattern, '', text, flags=re.DOTALL | re.IGNORECASE)
+    text = re.sub(r'\n\s*\n', '\n\n', text)
+    main_match = re.search(r"(ARTICLE TITLE.*?)\n\s*CyberVolt is a", text, re.DOTALL)
+    if main_match:
+        text = main_match.group(1)
+    return text.strip()
+
+
+FRAGMENTS = ["Sign up", "Sign in", "sIGN UP\n", "Top highlight", "Listen", "Share", "12", "4", "19", " ", "\n", "\n\n",
+             "Write a response", "Help", "Status", "About", "Jul", "Aug", "Reply", "reply", "<b>", "</b>", "<", ">",
+             "ARTICLE TITLE", "CyberVolt is a", "Top", "highlight", "word", "Sıgn up Sign in", "İ", "ſign"]
+
+
+@pytest.mark.parametrize("text", [
+    "Listen Sign up Sign in Share",
+    "Jul 12 34 19",
+    "Sign up Top highlight Sign in",
+    "Write a Top highlightresponse and more",
+    "Help <i>Status</i> About the footer",
+    "Reply 3 Jul 4reply",
+    "ARTICLE TITLE\nbody\n\n\nmore\n CyberVolt is a company",
+    "Sıgn up Sign in and ſign up SIGN IN",
+])
+def test_medium_cleaner_matches_old_cleaner(text):
+    assert cleaner_for("medium").clean(text) == old_clean_recon_article(text)
+
+
+def test_medium_cleaner_matches_old_cleaner_on_random_text():
+    rng = random.Random(18)
+    clean = cleaner_for("medium").clean
+    for _ in range(20000):
+        text = "".join(rng.choice(FRAGMENTS) + rng.choice(["", "", " ", "\n"]) for _ in range(rng.randint(1, 30)))
+        assert clean(text) == old_clean_recon_article(text), text
+
+
+@pytest.mark.parametrize("pattern, expected", [
+    ("Write a response.*", "Write a response"),
+    ("Help\\s+Status.*", "Help\\s+Status"),
+    ("a\\.*", None),
+    ("a|b.*", None),
+    (".*", None),
+    ("Top highlight", None),
+])
+def test_cut_prefix(pattern, expected):
+    assert _cut_prefix(pattern) == expected
@@ -0,0 +1,82 @@
+import re
+from typing import Dict, Iterable, Optional
+
+_TAG = re.compile(r"<[^>]+>")
+_BLANK_LINES = re.compile(r"\n\s*\n")
+
+
+def _cut_prefix(pattern: str) -> Optional[str]:
+    """X if pattern is "X.*", which under DOTALL deletes everything from the first match of X on."""
+    if not pattern.endswith(".*") or "|" in pattern:
+        return None
+    head = pattern[:-2]
+    if not head or (len(head) - len(head.rstrip("\\"))) % 2:
+        return None  # Empty, or the "." is escaped
+    return head
+
+
+class _Rule:
+    def __init__(self, pattern: str, flags: int):
+        cut = _cut_prefix(pattern)
+        self.cut = cut is not None
+        self.regex = re.compile(cut if self.cut else pattern, flags)
+
+    def apply(self, text: str) -> str:
+        if self.cut:
+            match = self.regex.search(text)
+            return text[:match.start()] if match else text
+        return self.regex.sub("", text)
+
+
+class TextCleaner:
+    """
+    Removes UI boilerplate from extracted article text.
+
+    rules are applied in order, each exactly like re.sub(rule, "", text, flags=flags | re.DOTALL):
+    a rule sees what earlier rules left, so removing one element can expose the next, and the
+    output is the same as running those re.sub calls. Patterns are compiled once, and a "X.*"
+    rule (drop everything from X on) cuts the text at the first X, so later rules scan less.
+    Blank-line runs are then collapsed and, if extract is set, its first group is kept.
+    """
+
+    def __init__(self, rules: Iterable[str] = (), extract: Optional[str] = None, strip_tags: bool = True,
+                 flags: int = re.IGNORECASE):
+        self._rules = [_Rule(rule, flags | re.DOTALL) for rule in rules]
+        self._extract = re.compile(extract, re.DOTALL) if extract else None
+        self._strip_tags = strip_tags
+
+    def clean(self, text: str) -> str:
+        if self._strip_tags and "<" in text:
+            text = _TAG.sub("", text)
+        for rule in self._rules:
+            text = rule.apply(text)
+        text = _BLANK_LINES.sub("\n\n", text)
+        if self._extract is not None:
+            match = self._extract.search(text)
+            if match:
+                text = match.group(1)
+        return text.strip()
+
+
+# Rule sets per source; scrapers look theirs up with cleaner_for()
+RULE_SETS: Dict[str, TextCleaner] = {
+    "medium": TextCleaner(
+        rules=[
+            r"Sign up\s+Sign in",
+            r"Top highlight",
+            r"Listen\s+Share",
+            r"\d+\s+\d+\s+19",  # Social metrics like claps/comments
+            r"Write a response.*",  # End of article sections
+            r"Help\s+Status\s+About.*",
+            r"Jul \d+|Aug \d+",  # Date snippets in comments
+            r"Reply\s+\d+\s+reply",
+        ],
+        # Isolates the body from the legal/nav footer on CyberVolt posts
+        extract=r"(ARTICLE TITLE.*?)\n\s*CyberVolt is a",
+    ),
+    "plain": TextCleaner(strip_tags=False),
+}
+
+
+def cleaner_for(source: str) -> TextCleaner:
+    return RULE_SETS.get(source, RULE_SETS["plain"])
@@ -1,30 +1,71 @@
 import os
+import functools
 import redis
-from rq import Worker, Queue
+from rq import Worker, SimpleWorker, Queue
 
-from lyrics_scraper import search_song, search_simpmusic_only
+from lyrics_scraper import search_song, search_simpmusic_only, search_simpmusic_batch
 from medium_scraper import MediumScraper
 from freedium_scraper import FreediumScraper
 from proxy_scraper import scrape_and_save_proxies
+from common import html_cache, proxy_pool, publish_cache_stats
+from db import db_manager
+import bulk
 
 listen = ['high', 'default', 'low']
 
+# "fork" (default) runs each job in a throwaway child process. "simple" runs jobs in the worker
+# process itself, so the pooled HTTP session, memory cache and proxy pool persist across jobs.
+worker_mode = os.getenv('RQ_WORKER_MODE', 'fork')
+
 redis_url = os.getenv('REDIS_URL')
 
 conn = redis.from_url(redis_url)
 
+def reports_cache_stats(job):
+    """Publishes the job's cache hits/misses when it ends; a forked job process takes its counters with it."""
+    @functools.wraps(job)
+    def wrapper(*args, **kwargs):
+        try:
+            return job(*args, **kwargs)
+        finally:
+            publish_cache_stats()
+    return wrapper
+
+@reports_cache_stats
 def scrape_lyrics(query):
     """
     Scrapes for song lyrics.
     """
     return search_song(query)
 
-def search_simpmusic(query, search_type):
+@reports_cache_stats
+def scrape_lyrics_bulk_item(batch_id, index, query):
+    """
+    Scrapes lyrics for one entry of a bulk lookup and records the outcome in its manifest.
+    Never raises, so the next job in the same lane still runs.
+    """
+    try:
+        result = search_song(query)
+    except Exception as e:
+        print(f"Bulk lookup {batch_id} item {index} failed: {e}")
+        bulk.record_item(conn, batch_id, index, query, "error", error=str(e))
+        return None
+    bulk.record_item(conn, batch_id, index, query, "found" if result else "not_found", result)
+    return result
+
+def search_simpmusic(query, search_type, index=None):
     """
     Searches SimpMusic API specifically.
     """
-    return search_simpmusic_only(query, search_type)
+    return search_simpmusic_only(query, search_type, index)
+
+def search_simpmusic_many(queries, search_type="song"):
+    """
+    Resolves a list of titles/artists against SimpMusic in one job.
+    """
+    return search_simpmusic_batch(queries, search_type)
 
+@reports_cache_stats
 def scrape_medium(url):
     """
     Scrapes a Medium article.
@@ -32,6 +73,7 @@ def scrape_medium(url):
     scraper = MediumScraper()
     return scraper.scrape_single(url)
 
+@reports_cache_stats
 def scrape_freedium(url):
     """
     Scrapes a Freedium article.
@@ -39,6 +81,7 @@ def scrape_freedium(url):
     scraper = FreediumScraper()
     return scraper.scrape_single(url)
 
+@reports_cache_stats
 def update_proxies():
     """
     Updates the proxy list.
@@ -47,6 +90,13 @@ def update_proxies():
 
 
 if __name__ == '__main__':
+    # Sweep the HTML cache from the long-lived parent only; forked job processes inherit its usage counters
+    html_cache.start_sweeper()
+    # Parse proxies.txt once here; job processes inherit it and only re-read it when it changes
+    proxy_pool.load()
+    # Same for the fuzzy lyrics index; job processes only top it up with lyrics saved since
+    db_manager.load_lyrics_index()
     queues = [Queue(q, connection=conn) for q in listen]
-    worker = Worker(queues, connection=conn)
+    worker_class = SimpleWorker if worker_mode == 'simple' else Worker
+    worker = worker_class(queues, connection=conn)
     worker.work()